@@ -0,0 +1,142 @@
+import hashlib
+import io
+import os
+import re
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+# Blobs are stored once per content hash: blobs/ab/cd/abcd...
+BLOB_DIR = os.environ.get("CONTACTS_BLOB_DIR", "blobs")
+MAX_PHOTO_BYTES = int(os.environ.get("CONTACTS_MAX_PHOTO_BYTES", str(5 * 1024 * 1024)))
+
+THUMBNAIL_SIZE = int(os.environ.get("CONTACTS_THUMBNAIL_SIZE", "128"))
+THUMBNAIL_WORKERS = int(os.environ.get("CONTACTS_THUMBNAIL_WORKERS", "2"))
+
+# Blobs never change under their hash, so clients may cache them for good
+BLOB_MAX_AGE = 365 * 24 * 3600
+
+_DIGEST = re.compile(r"^[0-9a-f]{64}$")
+
+_SIGNATURES = (
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"GIF87a", "image/gif"),
+    (b"GIF89a", "image/gif"),
+)
+
+
+def image_type(data):
+    """Content type of an image from its first bytes, or None if it is not one we accept"""
+    for signature, content_type in _SIGNATURES:
+        if data.startswith(signature):
+            return content_type
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "image/webp"
+    return None
+
+
+def blob_url(digest):
+    return f"/blobs/{digest}" if digest else None
+
+
+class BlobStore:
+    """Content-addressed files on disk; storing the same bytes twice keeps one copy"""
+
+    def __init__(self, directory=BLOB_DIR):
+        self.directory = directory
+
+    def path(self, digest):
+        if not _DIGEST.match(digest or ""):
+            raise Exception("Blob not found")
+        return os.path.join(self.directory, digest[:2], digest[2:4], digest)
+
+    def exists(self, digest):
+        return os.path.exists(self.path(digest))
+
+    def put(self, data):
+        """Store bytes and return their sha256 digest"""
+        digest = hashlib.sha256(data).hexdigest()
+        path = self.path(digest)
+        if os.path.exists(path):
+            return digest
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # write aside and rename, so readers never see half a blob
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(temp_path, path)
+        except Exception:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+        return digest
+
+    def read(self, digest):
+        with open(self.path(digest), "rb") as f:
+            return f.read()
+
+    def content_type(self, digest):
+        with open(self.path(digest), "rb") as f:
+            return image_type(f.read(16)) or "application/octet-stream"
+
+
+def make_thumbnail(data, size=THUMBNAIL_SIZE):
+    """Scale an image down to fit in size x size; needs Pillow (pip install pillow)"""
+    from PIL import Image, ImageOps
+
+    with Image.open(io.BytesIO(data)) as image:
+        image = ImageOps.exif_transpose(image)
+        image.thumbnail((size, size))
+        output = io.BytesIO()
+        if image.mode in ("RGBA", "LA", "P"):
+            image.save(output, format="PNG", optimize=True)
+        else:
+            image.convert("RGB").save(output, format="JPEG", quality=85)
+        return output.getvalue()
+
+
+class Thumbnailer:
+    """Worker pool that makes thumbnails off the request path
+
+    Without Pillow installed no thumbnails are made and clients keep using
+    the full photo.
+    """
+
+    def __init__(self, store, workers=THUMBNAIL_WORKERS, size=THUMBNAIL_SIZE):
+        self.store = store
+        self.workers = workers
+        self.size = size
+        self._executor = None
+        try:
+            import PIL  # noqa: F401
+            self.available = True
+        except ImportError:
+            self.available = False
+
+    def submit(self, digest, on_done):
+        """Thumbnail a stored blob, then call on_done(thumbnail_digest) from the worker"""
+        if not self.available:
+            return None
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="thumbnailer")
+        return self._executor.submit(self._run, digest, on_done)
+
+    def _run(self, digest, on_done):
+        try:
+            thumbnail = self.store.put(make_thumbnail(self.store.read(digest), self.size))
+            on_done(thumbnail)
+            return thumbnail
+        except Exception as e:
+            print(f"Thumbnail for blob {digest} failed: {e}")
+            return None
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+
+blob_store = BlobStore()
+thumbnailer = Thumbnailer(blob_store)
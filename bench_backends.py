@@ -0,0 +1,118 @@
+"""Compare the storage backends on the contact model workload
+
+    python bench_backends.py                      # SQLite only
+    python bench_backends.py --postgres-url 'postgresql://localhost/{name}'
+    python bench_backends.py --embedded-postgres  # needs pip install pgserver
+
+The Postgres url must contain {name}; the benchmark creates one database per
+shard on that server (and drops them again afterwards).
+"""
+import argparse
+import os
+import tempfile
+import time
+
+from backends import SQLiteBackend, PostgresBackend
+from database import set_backend
+from schema import UserModel, ContactModel
+from sharding import shard_router, shard_name
+
+
+def timed(label, count, func):
+    start = time.perf_counter()
+    func()
+    elapsed = time.perf_counter() - start
+    print(f"  {label:<24} {count:>7} ops  {elapsed:8.3f}s  {count / elapsed:10.0f} ops/s")
+
+
+def run_workload(contacts):
+    UserModel.create("Bench", "other", "0000000000", "bench@example.com", "x")
+    user_id = UserModel.find_by_email("bench@example.com")["id"]
+    UserModel.create("Bulk", "other", "0000000000", "bulk@example.com", "x")
+    bulk_user_id = UserModel.find_by_email("bulk@example.com")["id"]
+
+    def create():
+        for i in range(contacts):
+            ContactModel.create(f"Contact {i}", f"+1{i:010d}", "", None, "other", 0, user_id)
+
+    def update():
+        for contact in ContactModel.get_all(user_id):
+            ContactModel.update(contact["id"], user_id, contact_favorite=1)
+
+    def list_all():
+        for _ in range(20):
+            ContactModel.get_all(user_id)
+
+    def bulk_import():
+        ContactModel.import_contacts(bulk_user_id, [
+            {"contact_name": f"Bulk {i}", "contact_phone": f"+2{i:010d}"}
+            for i in range(contacts * 10)
+        ])
+
+    def move():
+        shard = shard_router.shard_for(bulk_user_id)
+        shard_router.move_user(bulk_user_id, (shard + 1) % shard_router.shard_count)
+
+    timed("create", contacts, create)
+    timed("update", contacts, update)
+    timed("get_all x20", contacts * 20, list_all)
+    timed("bulk import", contacts * 10, bulk_import)
+    if shard_router.shard_count > 1:
+        timed("move user", contacts * 10, move)
+
+
+def bench(backend, contacts):
+    print(f"{backend.name}:")
+    set_backend(backend)
+    shard_router._prepared.clear()
+    # creates the users/contacts tables and the shard directory
+    shard_router.connect(0).close()
+    try:
+        run_workload(contacts)
+    finally:
+        set_backend(None)
+
+
+def postgres_databases(url, shards, drop=False):
+    import psycopg2
+
+    conn = psycopg2.connect(url.replace("{name}", "postgres"))
+    conn.autocommit = True
+    cursor = conn.cursor()
+    for shard in range(shards):
+        cursor.execute(f"DROP DATABASE IF EXISTS {shard_name(shard)}")
+        if not drop:
+            cursor.execute(f"CREATE DATABASE {shard_name(shard)}")
+    conn.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--contacts", type=int, default=1000)
+    parser.add_argument("--shards", type=int, default=2)
+    parser.add_argument("--postgres-url")
+    parser.add_argument("--embedded-postgres", action="store_true")
+    args = parser.parse_args()
+
+    shard_router.shard_count = args.shards
+    postgres_url = args.postgres_url
+    server = None
+    workdir = tempfile.TemporaryDirectory()
+
+    if args.embedded_postgres:
+        import pgserver
+
+        server = pgserver.get_server(os.path.join(workdir.name, "pgdata"), cleanup_mode="stop")
+        postgres_url = server.get_uri().replace("/postgres?", "/{name}?")
+
+    bench(SQLiteBackend(workdir.name), args.contacts)
+    if postgres_url:
+        postgres_databases(postgres_url, args.shards)
+        try:
+            bench(PostgresBackend(postgres_url), args.contacts)
+        finally:
+            postgres_databases(postgres_url, args.shards, drop=True)
+
+    if server is not None:
+        server.cleanup()
+    workdir.cleanup()
@@ -0,0 +1,113 @@
+"""Microbenchmark of the contact update path
+
+    python bench_update.py --updates 5000
+
+Compares the old update (an f-string per field combination, sent over a
+fresh connection) with ContactModel.update (query builder over pooled
+connections) and reports the statement cache hit rate of the latter, for
+the UPDATE statements alone and for everything the update path sends
+(shard directory lookups and BEGINs included).
+"""
+import argparse
+import random
+import sqlite3
+import tempfile
+import time
+
+from backends import SQLiteBackend
+from database import set_backend, get_backend
+from schema import UserModel, ContactModel
+from sharding import shard_router
+from querybuilder import CONTACT_UPDATE_COLUMNS
+
+VALUES = {
+    "contact_name": lambda i: f"Name {i}",
+    "contact_phone": lambda i: f"+9{i:010d}",
+    "contact_email": lambda i: f"c{i}@example.com",
+    "contact_address": lambda i: f"{i} Main Street",
+    "contact_gender": lambda i: random.choice(["male", "female", "other"]),
+    "contact_favorite": lambda i: i % 2,
+}
+
+
+def random_updates(count, seed=1):
+    """Field dicts with random column subsets in random order"""
+    rng = random.Random(seed)
+    updates = []
+    for i in range(count):
+        columns = rng.sample(CONTACT_UPDATE_COLUMNS, rng.randint(1, len(CONTACT_UPDATE_COLUMNS)))
+        updates.append({column: VALUES[column](i) for column in columns})
+    return updates
+
+
+def legacy_update(path, contact_id, user_id, **kwargs):
+    # the update as it was before the query builder
+    set_clause = ", ".join([f"{key}=?" for key in kwargs.keys()])
+    values = list(kwargs.values())
+    values.extend([contact_id, user_id])
+    query = f"""
+    UPDATE contacts
+    SET {set_clause}, updatedAt=CURRENT_DATE
+    WHERE id=? AND user_id=?
+    """
+    conn = sqlite3.connect(path)
+    try:
+        conn.execute(query, values)
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def timed(label, count, func):
+    start = time.perf_counter()
+    func()
+    elapsed = time.perf_counter() - start
+    print(f"{label:<20} {count:>7} updates  {elapsed:8.3f}s  {count / elapsed:9.0f} updates/s")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--updates", type=int, default=5000)
+    parser.add_argument("--contacts", type=int, default=100)
+    args = parser.parse_args()
+
+    workdir = tempfile.TemporaryDirectory()
+    backend = SQLiteBackend(workdir.name)
+    set_backend(backend)
+    shard_router.connect(0).close()
+
+    UserModel.create("Bench", "other", "0000000000", "bench@example.com", "x")
+    user_id = UserModel.find_by_email("bench@example.com")["id"]
+    ContactModel.import_contacts(user_id, [
+        {"contact_name": f"Contact {i}", "contact_phone": f"+1{i:010d}"}
+        for i in range(args.contacts)
+    ])
+    contact_ids = [contact["id"] for contact in ContactModel.get_all(user_id)]
+    updates = random_updates(args.updates)
+    distinct = len({tuple(fields) for fields in updates})
+    print(f"{distinct} distinct field orders, {len({frozenset(fields) for fields in updates})} distinct field sets")
+
+    def run_legacy():
+        for i, fields in enumerate(updates):
+            legacy_update(backend.path("contacts"), contact_ids[i % len(contact_ids)], user_id, **fields)
+
+    def run_builder():
+        for i, fields in enumerate(updates):
+            ContactModel.update(contact_ids[i % len(contact_ids)], user_id, **fields)
+
+    timed("legacy", args.updates, run_legacy)
+    before = backend.statement_stats.snapshot()
+    timed("query builder", args.updates, run_builder)
+    after = get_backend().statement_stats.snapshot()
+
+    def report(label, after, before):
+        hits = after["hits"] - before.get("hits", 0)
+        misses = after["misses"] - before.get("misses", 0)
+        print(f"statement cache, {label:<16} {hits:>7} hits {misses:>7} misses  hit rate {hits / (hits + misses):.1%}")
+
+    report("UPDATE contacts", after["by_statement"]["UPDATE contacts"],
+           before["by_statement"].get("UPDATE contacts", {}))
+    report("all statements", after, before)
+
+    set_backend(None)
+    workdir.cleanup()
@@ -0,0 +1,83 @@
+"""Concurrent /add-contact throughput with and without the write pipeline
+
+    python bench_writes.py --threads 16 --requests 200
+
+Every mode runs against fresh SQLite files in a temporary directory (use
+--dir to put them on the disk you want to measure).
+"""
+import argparse
+import tempfile
+import threading
+import time
+
+from backends import SQLiteBackend
+from database import set_backend
+from main import app
+from schema import UserModel
+from sharding import shard_router
+from writer import write_pipeline, DURABILITY_SYNC, DURABILITY_ASYNC
+
+
+def add_contacts(user_id, worker, requests):
+    client = app.test_client()
+    for i in range(requests):
+        response = client.post("/add-contact", json={
+            "contact_name": f"Contact {worker}-{i}",
+            "contact_phone": f"+{worker:03d}{i:08d}",
+            "contact_email": "",
+            "contact_gender": "other",
+            "user_id": user_id
+        })
+        # 202: queued by the pipeline with async durability
+        if response.status_code not in (201, 202):
+            raise Exception(response.get_json()["message"])
+
+
+def bench(label, directory, threads, requests, pipeline, durability=DURABILITY_SYNC):
+    set_backend(SQLiteBackend(tempfile.mkdtemp(dir=directory)))
+    shard_router._prepared.clear()
+    shard_router.connect(0).close()
+    write_pipeline.enabled = pipeline
+    write_pipeline.durability = durability
+    write_pipeline.batches = write_pipeline.writes = 0
+
+    # one user per worker, spread over the shards
+    user_ids = []
+    for worker in range(threads):
+        email = f"bench{worker}@example.com"
+        UserModel.create("Bench", "other", "0000000000", email, "x")
+        user_ids.append(UserModel.find_by_email(email)["id"])
+
+    workers = [
+        threading.Thread(target=add_contacts, args=(user_id, worker, requests))
+        for worker, user_id in enumerate(user_ids)
+    ]
+    start = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    write_pipeline.flush()
+    elapsed = time.perf_counter() - start
+
+    total = threads * requests
+    line = f"{label:<16} {total:>7} requests  {elapsed:8.3f}s  {total / elapsed:9.0f} req/s"
+    if pipeline:
+        line += f"  {write_pipeline.writes / max(write_pipeline.batches, 1):6.1f} writes/batch"
+    print(line)
+    write_pipeline.stop()
+    set_backend(None)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--threads", type=int, default=16)
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--shards", type=int, default=1)
+    parser.add_argument("--dir")
+    args = parser.parse_args()
+
+    shard_router.shard_count = args.shards
+    bench("direct", args.dir, args.threads, args.requests, pipeline=False)
+    bench("pipeline sync", args.dir, args.threads, args.requests, pipeline=True)
+    bench("pipeline async", args.dir, args.threads, args.requests, pipeline=True, durability=DURABILITY_ASYNC)
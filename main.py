@@ -1,14 +1,20 @@
+import os
 from flask import Flask
 from flask_cors import CORS
 from router import routes 
+from maintenance import maintenance_scheduler
 
 app = Flask(__name__)
+# let a fronting nginx/Apache send photo blobs itself
+app.config["USE_X_SENDFILE"] = os.environ.get("USE_X_SENDFILE") == "1"
 CORS(app, origins=[
   "http://localhost:5173",
   "https://personal-contact-book.onrender.com"
 ])
 
 app.register_blueprint(routes)
+# scheduled incremental vacuum/ANALYZE, when CONTACTS_MAINTENANCE_INTERVAL is set
+maintenance_scheduler.start()
 
 if __name__=="__main__":
   app.run(host="0.0.0.0", port=8080, debug=True)
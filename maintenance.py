@@ -0,0 +1,427 @@
+"""Online backup, snapshot and compaction of the SQLite databases
+
+    python maintenance.py backup [--pages N] [--pause MS]
+    python maintenance.py snapshot
+    python maintenance.py list
+    python maintenance.py restore <snapshot>
+    python maintenance.py compact [--pages N]
+    python maintenance.py enable-incremental-vacuum
+    python maintenance.py enable-wal
+
+Every command covers contacts.db and all contact shards unless --db names one.
+
+contacts.db records which shard holds each user's contacts, so shards are
+only restored together: snapshot takes one set of all databases, and with
+more than one shard restore puts back the whole set the named snapshot
+belongs to and refuses snapshots without a complete set. The set is taken
+one database after the other, so do not move users while it runs.
+"""
+import gzip
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+from datetime import datetime, timezone
+
+from backends import SQLiteBackend
+from database import get_backend
+from sharding import shard_router, shard_name
+
+BACKUP_DIR = os.environ.get("CONTACTS_BACKUP_DIR", "backups")
+
+# Pages copied per backup step. The source is only locked while a step runs,
+# so this bounds how long a live write can be held up.
+BACKUP_PAGES = int(os.environ.get("CONTACTS_BACKUP_PAGES", "256"))
+# Pause between steps so queued writers get the database in between
+BACKUP_PAUSE = float(os.environ.get("CONTACTS_BACKUP_PAUSE_MS", "5")) / 1000
+# Restarts caused by concurrent writes before the backup finishes in one step
+BACKUP_MAX_RESTARTS = int(os.environ.get("CONTACTS_BACKUP_MAX_RESTARTS", "3"))
+
+# Seconds between scheduled compactions; 0 turns the schedule off
+MAINTENANCE_INTERVAL = float(os.environ.get("CONTACTS_MAINTENANCE_INTERVAL", "0"))
+# Free pages handed back to the filesystem per compaction; 0 means all of them
+VACUUM_PAGES = int(os.environ.get("CONTACTS_VACUUM_PAGES", "1000"))
+
+
+def _sqlite_backend():
+    backend = get_backend()
+    if not isinstance(backend, SQLiteBackend):
+        raise Exception("Backups and compaction need the SQLite backend; use pg_dump/VACUUM on PostgreSQL")
+    return backend
+
+
+def database_names():
+    """Names of contacts.db and every contact shard"""
+    return [shard_name(shard) for shard in shard_router.shards()]
+
+
+def check_database(db_name):
+    """Reject anything but a known database name; names end up in file paths"""
+    if db_name not in database_names():
+        raise Exception(f"Unknown database: {db_name}")
+    return db_name
+
+
+def _snapshot_path(directory, file_name):
+    """Path of a file in the snapshot directory, refusing names that lead elsewhere"""
+    if (not file_name or file_name in (".", "..") or os.path.basename(file_name) != file_name
+            or (os.altsep and os.altsep in file_name)):
+        raise Exception(f"Invalid snapshot name: {file_name}")
+    return os.path.join(directory, file_name)
+
+
+class _TooManyRestarts(Exception):
+    pass
+
+
+def backup(db_name, destination, pages=BACKUP_PAGES, pause=BACKUP_PAUSE, max_restarts=BACKUP_MAX_RESTARTS):
+    """Copy a live database to a file, a few pages at a time
+
+    SQLite starts a stepped backup over whenever another connection writes to
+    the source, so after max_restarts the rest is copied in a single step.
+    That step only leaves writers alone in WAL mode; in any other journal
+    mode it would lock the live database for the whole copy, so the backup
+    fails instead. Returns throughput and how long each step held the
+    source, which is the longest a live write had to wait on the backup.
+    """
+    backend = _sqlite_backend()
+    source = backend.connect(check_database(db_name))
+    journal_mode = source.execute("PRAGMA journal_mode").fetchone()[0]
+    target = None
+    steps = []
+    restarts = 0
+    remaining_before = None
+    last = None
+
+    def progress(status, remaining, total):
+        nonlocal last, restarts, remaining_before
+        steps.append(time.perf_counter() - last)
+        if remaining_before is not None and remaining > remaining_before:
+            restarts += 1
+            if restarts > max_restarts:
+                raise _TooManyRestarts()
+        remaining_before = remaining
+        if remaining and pause:
+            time.sleep(pause)
+        last = time.perf_counter()
+
+    try:
+        target = backend.open_file(destination)
+        start = last = time.perf_counter()
+        single_step = False
+        try:
+            source.backup(target, pages=pages, progress=progress)
+        except _TooManyRestarts:
+            if journal_mode != "wal":
+                raise Exception(
+                    f"Backup of {db_name} restarted {restarts} times under concurrent writes; "
+                    f"copying the rest in one step would lock it in {journal_mode} journal mode. "
+                    "Switch it to WAL (maintenance.py enable-wal) or retry when writes are quieter"
+                )
+            single_step = True
+            last = time.perf_counter()
+            source.backup(target)
+            steps.append(time.perf_counter() - last)
+        elapsed = time.perf_counter() - start
+        page_size = target.execute("PRAGMA page_size").fetchone()[0]
+        page_count = target.execute("PRAGMA page_count").fetchone()[0]
+    finally:
+        if target is not None:
+            target.close()
+        source.close()
+
+    size = page_size * page_count
+    return {
+        "database": db_name,
+        "destination": destination,
+        "bytes": size,
+        "seconds": round(elapsed, 4),
+        "mb_per_second": round(size / elapsed / 1e6, 2) if elapsed else None,
+        "steps": len(steps),
+        "restarts": restarts,
+        "single_step_fallback": single_step,
+        "journal_mode": journal_mode,
+        "max_stall_ms": round(max(steps, default=0) * 1000, 3),
+        "mean_stall_ms": round(sum(steps) / len(steps) * 1000, 3) if steps else 0,
+    }
+
+
+def _sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _stamp():
+    return datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S%fZ")
+
+
+def snapshot(db_name, directory=BACKUP_DIR, pages=BACKUP_PAGES, pause=BACKUP_PAUSE, stamp=None):
+    """Take an online backup and store it gzipped with a checksum manifest
+
+    Snapshots sharing a stamp form a set that restore() puts back together.
+    """
+    check_database(db_name)
+    os.makedirs(directory, exist_ok=True)
+    stamp = stamp or _stamp()
+    name = f"{db_name}-{stamp}"
+    archive = os.path.join(directory, f"{name}.db.gz")
+
+    with tempfile.TemporaryDirectory(dir=directory) as workdir:
+        copy = os.path.join(workdir, f"{name}.db")
+        stats = backup(db_name, copy, pages, pause)
+        del stats["destination"]
+        start = time.perf_counter()
+        with open(copy, "rb") as src, gzip.open(archive, "wb", compresslevel=6) as dst:
+            shutil.copyfileobj(src, dst, 1 << 20)
+        stats["compress_seconds"] = round(time.perf_counter() - start, 4)
+
+    manifest = {
+        "database": db_name,
+        "created": stamp,
+        "set": stamp,
+        "archive": os.path.basename(archive),
+        "bytes": stats["bytes"],
+        "compressed_bytes": os.path.getsize(archive),
+        "sha256": _sha256(archive),
+    }
+    with open(os.path.join(directory, f"{name}.json"), "w") as f:
+        json.dump(manifest, f, indent=2)
+    stats.update(manifest)
+    return stats
+
+
+def snapshot_set(directory=BACKUP_DIR, pages=BACKUP_PAGES, pause=BACKUP_PAUSE):
+    """Snapshot contacts.db and every shard as one set"""
+    stamp = _stamp()
+    return [snapshot(db_name, directory, pages, pause, stamp) for db_name in database_names()]
+
+
+def list_snapshots(directory=BACKUP_DIR):
+    """Manifests of the snapshots in a directory, oldest first"""
+    if not os.path.isdir(directory):
+        return []
+    manifests = []
+    for entry in sorted(os.listdir(directory)):
+        if entry.endswith(".json"):
+            with open(os.path.join(directory, entry)) as f:
+                manifests.append(json.load(f))
+    return manifests
+
+
+def _unpack(manifest, directory, workdir):
+    """Check a snapshot against its manifest and unpack it into workdir"""
+    check_database(manifest["database"])
+    archive = _snapshot_path(directory, manifest["archive"])
+    if _sha256(archive) != manifest["sha256"]:
+        raise Exception(f"Checksum mismatch, snapshot is damaged: {manifest['archive']}")
+
+    copy = os.path.join(workdir, f"{manifest['database']}.db")
+    with gzip.open(archive, "rb") as src, open(copy, "wb") as dst:
+        shutil.copyfileobj(src, dst, 1 << 20)
+    conn = _sqlite_backend().open_file(copy)
+    try:
+        if conn.execute("PRAGMA integrity_check").fetchone()[0] != "ok":
+            raise Exception(f"Snapshot failed integrity check: {manifest['archive']}")
+    finally:
+        conn.close()
+    return copy
+
+
+def restore(snapshot_name, directory=BACKUP_DIR):
+    """Verify a snapshot and copy it over its live database
+
+    With more than one shard, restoring contacts.db alone would turn the
+    user -> shard directory back while users moved since then have their
+    contacts elsewhere. There every database is restored from the set the
+    snapshot belongs to, and a snapshot without a complete set is refused.
+    Nothing is overwritten until every snapshot of the set checks out.
+    """
+    backend = _sqlite_backend()
+    name = snapshot_name[:-len(".db.gz")] if snapshot_name.endswith(".db.gz") else snapshot_name
+    manifest_path = _snapshot_path(directory, name) + ".json"
+    if not os.path.exists(manifest_path):
+        raise Exception(f"Snapshot not found: {snapshot_name}")
+    with open(manifest_path) as f:
+        manifest = json.load(f)
+    # the manifest is a file on disk too; trust none of its names blindly
+    check_database(manifest["database"])
+
+    names = database_names()
+    if len(names) == 1:
+        manifests = [manifest]
+    else:
+        manifests = [
+            other for other in list_snapshots(directory)
+            if manifest.get("set") and other.get("set") == manifest["set"]
+        ]
+        missing = sorted(set(names) - {other["database"] for other in manifests})
+        if missing:
+            raise Exception(
+                f"Incomplete snapshot set: {snapshot_name} has no matching snapshot of "
+                f"{', '.join(missing)}; restoring shards separately would leave users "
+                "pointing at the wrong shard"
+            )
+
+    results = []
+    with tempfile.TemporaryDirectory(dir=directory) as workdir:
+        copies = [_unpack(other, directory, workdir) for other in manifests]
+        for other, copy in zip(manifests, copies):
+            start = time.perf_counter()
+            source = backend.open_file(copy)
+            target = backend.connect(other["database"])
+            try:
+                # one step: live writers wait for the restore instead of seeing half of it
+                source.backup(target.raw)
+            finally:
+                target.close()
+                source.close()
+            results.append({
+                "database": other["database"],
+                "snapshot": other["archive"],
+                "bytes": other["bytes"],
+                "seconds": round(time.perf_counter() - start, 4),
+            })
+    return results
+
+
+def enable_incremental_vacuum(db_name):
+    """Switch a database to incremental auto-vacuum
+
+    This rewrites the whole file once with VACUUM, so run it in a quiet moment.
+    """
+    conn = _sqlite_backend().connect(check_database(db_name))
+    try:
+        conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        conn.execute("VACUUM")
+        return conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2
+    finally:
+        conn.close()
+
+
+def enable_wal(db_name):
+    """Switch a database to write-ahead logging
+
+    Readers, backups included, then no longer hold up writers, so a backup
+    that falls back to a single step does not stall live requests either.
+    """
+    conn = _sqlite_backend().connect(check_database(db_name))
+    try:
+        return conn.execute("PRAGMA journal_mode=WAL").fetchone()[0] == "wal"
+    finally:
+        conn.close()
+
+
+def compact(db_name, pages=VACUUM_PAGES):
+    """Hand free pages back to the filesystem and refresh planner statistics"""
+    conn = _sqlite_backend().connect(check_database(db_name))
+    try:
+        start = time.perf_counter()
+        free_before = conn.execute("PRAGMA freelist_count").fetchone()[0]
+        incremental = conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2
+        if incremental:
+            # execute() steps a row-less pragma only once, which frees a single
+            # page; executescript() runs it to completion
+            conn.executescript(f"PRAGMA incremental_vacuum({int(pages)});")
+        conn.execute("ANALYZE")
+        conn.commit()
+        return {
+            "database": db_name,
+            "incremental_vacuum": incremental,
+            "free_pages_before": free_before,
+            "free_pages_after": conn.execute("PRAGMA freelist_count").fetchone()[0],
+            "seconds": round(time.perf_counter() - start, 4),
+        }
+    finally:
+        conn.close()
+
+
+class MaintenanceScheduler:
+    """Background thread that compacts every database at a fixed interval"""
+
+    def __init__(self, interval=MAINTENANCE_INTERVAL, pages=VACUUM_PAGES):
+        self.interval = interval
+        self.pages = pages
+        self.last_run = []
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self.interval <= 0 or self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name="contact-maintenance", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.last_run = [compact(db_name, self.pages) for db_name in database_names()]
+            except Exception as e:
+                print(f"Scheduled compaction failed: {e}")
+
+
+maintenance_scheduler = MaintenanceScheduler()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--db", help="only this database, e.g. contacts or contacts_shard1")
+    parser.add_argument("--dir", default=BACKUP_DIR)
+    commands = parser.add_subparsers(dest="command", required=True)
+    backup_parser = commands.add_parser("backup", help="copy the databases to --dir")
+    snapshot_parser = commands.add_parser(
+        "snapshot",
+        help="compressed, checksummed backup of all databases as one set into --dir"
+    )
+    for command in (backup_parser, snapshot_parser):
+        command.add_argument("--pages", type=int, default=BACKUP_PAGES)
+        command.add_argument("--pause", type=float, default=BACKUP_PAUSE * 1000, help="milliseconds between steps")
+    commands.add_parser("list", help="list snapshots in --dir")
+    restore_parser = commands.add_parser(
+        "restore",
+        help="restore a snapshot over its database; with several shards, its whole set over all of them"
+    )
+    restore_parser.add_argument("snapshot")
+    compact_parser = commands.add_parser("compact", help="incremental vacuum and ANALYZE")
+    compact_parser.add_argument("--pages", type=int, default=VACUUM_PAGES)
+    commands.add_parser("enable-incremental-vacuum", help="one-off VACUUM switching to incremental auto-vacuum")
+    commands.add_parser("enable-wal", help="switch to write-ahead logging so backups never block writers")
+    args = parser.parse_args()
+
+    names = [args.db] if args.db else database_names()
+    if args.command == "backup":
+        os.makedirs(args.dir, exist_ok=True)
+        stamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+        results = [
+            backup(name, os.path.join(args.dir, f"{name}-{stamp}.db"), args.pages, args.pause / 1000)
+            for name in names
+        ]
+    elif args.command == "snapshot":
+        if args.db:
+            results = [snapshot(args.db, args.dir, args.pages, args.pause / 1000)]
+        else:
+            results = snapshot_set(args.dir, args.pages, args.pause / 1000)
+    elif args.command == "list":
+        results = list_snapshots(args.dir)
+    elif args.command == "restore":
+        results = restore(args.snapshot, args.dir)
+    elif args.command == "compact":
+        results = [compact(name, args.pages) for name in names]
+    elif args.command == "enable-incremental-vacuum":
+        results = [{"database": name, "incremental": enable_incremental_vacuum(name)} for name in names]
+    else:
+        results = [{"database": name, "wal": enable_wal(name)} for name in names]
+    print(json.dumps(results, indent=2))
@@ -0,0 +1,41 @@
+from functools import lru_cache
+
+# Columns a client may change on a contact, in the order they appear in SET clauses
+CONTACT_UPDATE_COLUMNS = (
+    "contact_name",
+    "contact_phone",
+    "contact_email",
+    "contact_address",
+    "contact_gender",
+    "contact_favorite",
+)
+
+
+def canonical_columns(fields, allowed):
+    """Order the given field names as in the allowlist, rejecting anything else"""
+    unknown = sorted(set(fields) - set(allowed))
+    if unknown:
+        raise Exception(f"Unknown fields: {', '.join(unknown)}")
+    return tuple(column for column in allowed if column in fields)
+
+
+@lru_cache(maxsize=256)
+def _update_sql(table, columns, where, touch):
+    set_clause = ", ".join([f"{column}=?" for column in columns] + [f"{column}=CURRENT_DATE" for column in touch])
+    where_clause = " AND ".join(f"{column}=?" for column in where)
+    return f"UPDATE {table} SET {set_clause} WHERE {where_clause}"
+
+
+def build_update(table, allowed, fields, where, touch=("updatedAt",)):
+    """Build an UPDATE for a dict of changed fields
+
+    Any set of fields maps to one SQL string whatever order the fields came in,
+    so the statement is prepared once per connection and reused from then on.
+    Returns the SQL and the parameters, SET values first, then the where values.
+    """
+    if not fields:
+        raise Exception("No fields to update provided")
+    columns = canonical_columns(fields, allowed)
+    query = _update_sql(table, columns, tuple(where), tuple(touch))
+    params = [fields[column] for column in columns] + list(where.values())
+    return query, params
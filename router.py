@@ -1,7 +1,14 @@
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, Response, current_app, request, jsonify, send_file
 import bcrypt
+import hmac
+import os
 print("bcrypt is working!")
-from schema import UserModel, ContactModel, get_profile
+from schema import UserModel, ContactModel, PhotoModel, get_profile
+from database import get_backend
+from querybuilder import CONTACT_UPDATE_COLUMNS
+import maintenance
+from werkzeug.exceptions import RequestEntityTooLarge
+from attachments import blob_store, thumbnailer, image_type, blob_url, MAX_PHOTO_BYTES, BLOB_MAX_AGE
 
 routes = Blueprint("routes", __name__)
 
@@ -10,6 +17,16 @@ def health_check():
     return {"status": "ok"}
 
 
+@routes.route("/stats", methods=["GET"])
+def stats():
+    return jsonify({
+        "status": 200,
+        "backend": get_backend().name,
+        "statement_cache": get_backend().statement_stats.snapshot(),
+        "statement_cache_note": "mirrored per-connection LRU of the SQL strings sent, not SQLite's own counters"
+    })
+
+
 def validate_required_fields(data, required_fields):
     """Validate required fields in request data"""
     missing_fields = [field for field in required_fields if not data.get(field)]
@@ -17,6 +34,18 @@ def validate_required_fields(data, required_fields):
         return False, f"Missing required fields: {', '.join(missing_fields)}"
     return True, None
 
+
+def write_queued():
+    """Response for a contact write the write pipeline queued without running it
+
+    With async durability the outcome is not known yet, so this promises
+    neither success nor any data.
+    """
+    return jsonify({
+        "status": 202,
+        "message": "Request accepted and queued for processing"
+    }), 202
+
 # ==================== Authentication Routes ====================
 
 @routes.route("/login", methods=["POST"])
@@ -140,19 +169,32 @@ def forgot_password():
 @routes.route("/contacts/<int:user_id>", methods=["GET"])
 def fetch_contacts(user_id):
     try:
-        contacts = ContactModel.get_all(user_id)
+        contacts = ContactModel.iter_all(user_id)
+        first = next(contacts, None)
         
-        if not contacts:
+        if first is None:
+            contacts.close()
             return jsonify({
                 "status": 404,
                 "message": "No contacts found"
             }), 404
-            
-        return jsonify({
-            "status": 200,
-            "count": len(contacts),
-            "contacts": contacts
-        })
+        
+        # Written out contact by contact as rows arrive, so a large address
+        # book is never held in memory whole; count follows the list.
+        dumps = current_app.json.dumps
+        
+        def generate():
+            count = 1
+            try:
+                yield '{"status": 200, "contacts": [' + dumps(first)
+                for contact in contacts:
+                    count += 1
+                    yield ", " + dumps(contact)
+                yield f'], "count": {count}}}\n'
+            finally:
+                contacts.close()
+        
+        return Response(generate(), mimetype="application/json")
         
     except Exception as e:
         return jsonify({
@@ -183,7 +225,7 @@ def add_contact():
 
 
         # Create new contact
-        ContactModel.create(
+        created = ContactModel.create(
             contact_name=data["contact_name"],
             contact_phone=data["contact_phone"],
             contact_email=data.get("contact_email"),
@@ -192,6 +234,8 @@ def add_contact():
             contact_favorite=data.get("contact_favorite", 0),
             user_id=data["user_id"]
         )
+        if created is None:
+            return write_queued()
 
         added_contact = ContactModel.get_added_contact(phone, user_id)
         
@@ -208,6 +252,56 @@ def add_contact():
         }), 500
 
 
+# A whole import is built in memory and sent as one COPY/executemany
+MAX_IMPORT_CONTACTS = int(os.environ.get("CONTACTS_MAX_IMPORT_CONTACTS", "5000"))
+
+
+@routes.route("/import-contacts", methods=["POST"])
+def import_contacts():
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({"status": 400, "message": "Request body must be a JSON object"}), 400
+    
+    # Validate required fields
+    valid, error = validate_required_fields(data, ["user_id", "contacts"])
+    if not valid:
+        return jsonify({"status": 400, "message": error}), 400
+    
+    contacts = data["contacts"]
+    if not isinstance(contacts, list) or not all(isinstance(contact, dict) for contact in contacts):
+        return jsonify({"status": 400, "message": "contacts must be a list of contact objects"}), 400
+    if len(contacts) > MAX_IMPORT_CONTACTS:
+        return jsonify({
+            "status": 413,
+            "message": f"Too many contacts, at most {MAX_IMPORT_CONTACTS} per import"
+        }), 413
+    
+    for index, contact in enumerate(contacts):
+        valid, error = validate_required_fields(contact, ["contact_name", "contact_phone"])
+        if not valid:
+            return jsonify({"status": 400, "message": f"Contact {index}: {error}"}), 400
+    
+    try:
+        imported = ContactModel.import_contacts(data["user_id"], data["contacts"])
+        return jsonify({
+            "status": 201,
+            "message": "Contacts imported successfully",
+            "count": imported
+        }), 201
+        
+    except Exception as e:
+        error_message = str(e)
+        if "unique" in error_message.lower():
+            return jsonify({
+                "status": 409,
+                "message": "Contact number already exists"
+            }), 409
+        return jsonify({
+            "status": 500,
+            "message": f"Failed to import contacts: {error_message}"
+        }), 500
+
+
 @routes.route("/delete-contact/<int:contact_id>", methods=["DELETE"])
 def delete_contact(contact_id):
     data = request.get_json()
@@ -220,7 +314,8 @@ def delete_contact(contact_id):
         }), 400
     
     try:
-        ContactModel.delete(contact_id, data["user_id"])
+        if ContactModel.delete(contact_id, data["user_id"]) is None:
+            return write_queued()
         return jsonify({
             "status": 200,
             "message": "Contact deleted successfully"
@@ -254,14 +349,7 @@ def update_contact(contact_id):
         # Update contact fields
         update_data = {
             key: data[key] 
-            for key in [
-                "contact_name", 
-                "contact_phone", 
-                "contact_email", 
-                "contact_address", 
-                "contact_gender", 
-                "contact_favorite"
-            ] 
+            for key in CONTACT_UPDATE_COLUMNS
             if key in data
         }
         
@@ -271,7 +359,8 @@ def update_contact(contact_id):
                 "message": "No valid fields provided for update"
             }), 400
         
-        ContactModel.update(contact_id, data["user_id"], **update_data)
+        if ContactModel.update(contact_id, data["user_id"], **update_data) is None:
+            return write_queued()
         return jsonify({
             "status": 200,
             "message": "Contact updated successfully"
@@ -291,6 +380,126 @@ def update_contact(contact_id):
     
 
 
+# ==================== Contact Photo Routes ====================
+
+@routes.route("/contact-photo/<int:contact_id>", methods=["PUT"])
+def upload_contact_photo(contact_id):
+    # Cap the body before anything reads it: chunked uploads carry no
+    # Content-Length, and form parsing takes in the whole body at once
+    request.max_content_length = MAX_PHOTO_BYTES + 64 * 1024
+    try:
+        # multipart form with user_id and a photo file, or the raw image with ?user_id=
+        user_id = request.form.get("user_id") or request.args.get("user_id")
+        upload = request.files.get("photo")
+        data = upload.read(MAX_PHOTO_BYTES + 1) if upload else request.get_data()
+    except RequestEntityTooLarge:
+        return jsonify({"status": 413, "message": "Photo is too large"}), 413
+    
+    if not user_id or not user_id.isdigit():
+        return jsonify({
+            "status": 400,
+            "message": "Missing user_id in request"
+        }), 400
+    user_id = int(user_id)
+    
+    if not data:
+        return jsonify({"status": 400, "message": "Missing photo in request"}), 400
+    if len(data) > MAX_PHOTO_BYTES:
+        return jsonify({"status": 413, "message": "Photo is too large"}), 413
+    if not image_type(data):
+        return jsonify({
+            "status": 415,
+            "message": "Photo must be a JPEG, PNG, GIF or WebP image"
+        }), 415
+    
+    try:
+        # check before storing: blobs nothing points at are never cleaned up
+        if not ContactModel.get_by_id(contact_id, user_id):
+            return jsonify({
+                "status": 404,
+                "message": "Contact not found or not owned by user"
+            }), 404
+        digest = blob_store.put(data)
+        if PhotoModel.set(contact_id, user_id, digest) is None:
+            return write_queued()
+        thumbnailer.submit(
+            digest,
+            lambda thumbnail: PhotoModel.set_thumbnail(contact_id, user_id, digest, thumbnail)
+        )
+        return jsonify({
+            "status": 201,
+            "message": "Photo uploaded successfully",
+            "photo_url": blob_url(digest)
+        }), 201
+        
+    except Exception as e:
+        error_message = str(e)
+        if "not found" in error_message.lower():
+            return jsonify({
+                "status": 404,
+                "message": error_message
+            }), 404
+        return jsonify({
+            "status": 500,
+            "message": f"Failed to upload photo: {error_message}"
+        }), 500
+
+
+@routes.route("/contact-photo/<int:contact_id>", methods=["DELETE"])
+def delete_contact_photo(contact_id):
+    data = request.get_json(silent=True)
+    
+    # Validate required fields
+    if not data or "user_id" not in data:
+        return jsonify({
+            "status": 400,
+            "message": "Missing user_id in request"
+        }), 400
+    
+    try:
+        deleted = PhotoModel.delete(contact_id, data["user_id"])
+        if deleted is None:
+            return write_queued()
+        if not deleted:
+            return jsonify({
+                "status": 404,
+                "message": "Contact has no photo"
+            }), 404
+        return jsonify({
+            "status": 200,
+            "message": "Photo deleted successfully"
+        })
+        
+    except Exception as e:
+        return jsonify({
+            "status": 500,
+            "message": f"Failed to delete photo: {str(e)}"
+        }), 500
+
+
+@routes.route("/blobs/<digest>", methods=["GET"])
+def serve_blob(digest):
+    try:
+        path = os.path.abspath(blob_store.path(digest))
+    except Exception:
+        return jsonify({"status": 404, "message": "Blob not found"}), 404
+    if not os.path.exists(path):
+        return jsonify({"status": 404, "message": "Blob not found"}), 404
+    
+    # conditional=True answers Range and If-None-Match requests; full files go
+    # out through the server's file wrapper (sendfile) or X-Sendfile
+    response = send_file(
+        path,
+        mimetype=blob_store.content_type(digest),
+        conditional=True,
+        etag=digest,
+        max_age=BLOB_MAX_AGE
+    )
+    response.headers["Cache-Control"] = f"public, max-age={BLOB_MAX_AGE}, immutable"
+    response.headers["X-Content-Type-Options"] = "nosniff"
+    return response
+
+
 @routes.route("/profile/<int:user_id>", methods=["GET"])
 def handle_get_profile(user_id):
     try:
@@ -373,4 +582,80 @@ def update_profile(user_id):
         return jsonify({
             "status": 500,
             "message": f"Failed to update profile: {str(e)}"
-        }), 500
\ No newline at end of file
+        }), 500
+
+
+# ==================== Admin Routes ====================
+
+# Admin routes stay disabled unless a token is configured
+ADMIN_TOKEN = os.environ.get("CONTACTS_ADMIN_TOKEN")
+
+
+def admin_authorized():
+    token = request.headers.get("X-Admin-Token", "")
+    return bool(ADMIN_TOKEN) and hmac.compare_digest(token, ADMIN_TOKEN)
+
+
+def run_admin_task(task, label):
+    if not admin_authorized():
+        return jsonify({"status": 403, "message": "Admin access denied"}), 403
+    
+    try:
+        return jsonify({"status": 200, "results": task()})
+    except Exception as e:
+        error_message = str(e)
+        if "not found" in error_message.lower():
+            return jsonify({"status": 404, "message": error_message}), 404
+        if error_message.startswith(("Unknown database", "Invalid snapshot name", "Incomplete snapshot set")):
+            return jsonify({"status": 400, "message": error_message}), 400
+        return jsonify({
+            "status": 500,
+            "message": f"{label} failed: {error_message}"
+        }), 500
+
+
+def admin_databases():
+    data = request.get_json(silent=True) or {}
+    if data.get("db"):
+        return [maintenance.check_database(data["db"])]
+    return maintenance.database_names()
+
+
+@routes.route("/admin/snapshots", methods=["GET"])
+def admin_list_snapshots():
+    return run_admin_task(maintenance.list_snapshots, "Listing snapshots")
+
+
+@routes.route("/admin/snapshots", methods=["POST"])
+def admin_snapshot():
+    data = request.get_json(silent=True) or {}
+    if data.get("db"):
+        # a single database cannot be restored on its own once there are shards
+        return run_admin_task(lambda: [maintenance.snapshot(admin_databases()[0])], "Snapshot")
+    return run_admin_task(maintenance.snapshot_set, "Snapshot")
+
+
+@routes.route("/admin/restore", methods=["POST"])
+def admin_restore():
+    # With several shards the whole snapshot set is restored, see maintenance.restore
+    data = request.get_json(silent=True) or {}
+    if not data.get("snapshot"):
+        return jsonify({"status": 400, "message": "Missing required fields: snapshot"}), 400
+    return run_admin_task(lambda: maintenance.restore(data["snapshot"]), "Restore")
+
+
+@routes.route("/admin/compact", methods=["POST"])
+def admin_compact():
+    return run_admin_task(
+        lambda: [maintenance.compact(name) for name in admin_databases()],
+        "Compaction"
+    )
+
+
+@routes.route("/admin/maintenance", methods=["GET"])
+def admin_maintenance_status():
+    scheduler = maintenance.maintenance_scheduler
+    return run_admin_task(
+        lambda: {"interval": scheduler.interval, "last_run": scheduler.last_run},
+        "Maintenance status"
+    )
@@ -1,15 +1,40 @@
 from flask import Flask
-import sqlite3
-from database import create_connection
+from datetime import date
+from database import create_connection, get_backend
+from sharding import shard_router, is_read
+from writer import write_pipeline
+from querybuilder import build_update, CONTACT_UPDATE_COLUMNS
+from attachments import blob_url
 
 app = Flask(__name__)
 
+# Contacts carry only links to their photo; the bytes are served from /blobs
+CONTACT_SELECT = """
+SELECT contacts.*, contact_photos.photo_hash, contact_photos.thumbnail_hash
+FROM contacts
+LEFT JOIN contact_photos
+    ON contact_photos.contact_id = contacts.id AND contact_photos.user_id = contacts.user_id
+"""
+
 class BaseModel:
     """Base model with common database operations"""
     
     @staticmethod
-    def execute_query(query, params=(), fetch_one=False):
-        """Helper method to execute database queries"""
+    def execute_query(query, params=(), fetch_one=False, user_id=None):
+        """Helper method to execute database queries
+
+        Contact writes queued by the write pipeline with async durability
+        return None instead of a row count, since they have not run yet.
+        """
+        if user_id is not None:
+            # Contact queries go to the shard that holds the user's contacts
+            try:
+                if write_pipeline.enabled and not is_read(query):
+                    return write_pipeline.submit(user_id, query, params)
+                return shard_router.execute(user_id, query, params, fetch_one)
+            except get_backend().Error as e:
+                raise Exception(f"Database error: {str(e)}")
+
         conn = None
         cursor = None
         try:
@@ -21,7 +46,7 @@ class BaseModel:
             if fetch_one:
                 return cursor.fetchone()
             return cursor.rowcount
-        except sqlite3.Error as e:
+        except get_backend().Error as e:
             raise Exception(f"Database error: {str(e)}")
         finally:
             if cursor:
@@ -50,6 +75,14 @@ class UserModel(BaseModel):
                 query, 
                 (name, gender, phone, email, password)
             )
+            if rows_affected > 0:
+                try:
+                    user = UserModel.find_by_email(email)
+                    shard_router.assign(user["id"])
+                except Exception as e:
+                    # the user exists either way; without a directory entry
+                    # their contacts simply stay on shard 0
+                    print(f"Failed to assign a shard to user {email}: {str(e)}")
             return rows_affected > 0
         except Exception as e:
             raise Exception(f"Failed to create user: {str(e)}")
@@ -129,16 +162,20 @@ class ContactModel(BaseModel):
     @staticmethod
     def create(contact_name, contact_phone, contact_email, contact_address, contact_gender, contact_favorite, user_id):
         """Create a new contact"""
-        query = """
+        # the id comes from the shard's own range, see SQLiteBackend.next_id_sql
+        query = f"""
         INSERT INTO contacts 
-        (contact_name, contact_phone, contact_email, contact_address, contact_gender, contact_favorite, user_id, createdAt, updatedAt)
-        VALUES (?, ?, ?, ?, ?, ?, ?, CURRENT_DATE, CURRENT_DATE)
+        (id, contact_name, contact_phone, contact_email, contact_address, contact_gender, contact_favorite, user_id, createdAt, updatedAt)
+        VALUES ({get_backend().next_id_sql("contacts")}, ?, ?, ?, ?, ?, ?, ?, CURRENT_DATE, CURRENT_DATE)
         """
         try:
             rows_affected = BaseModel.execute_query(
                 query,
-                (contact_name, contact_phone, contact_email, contact_address, contact_gender, contact_favorite, user_id)
+                (contact_name, contact_phone, contact_email, contact_address, contact_gender, contact_favorite, user_id),
+                user_id=user_id
             )
+            if rows_affected is None:
+                return None
             return rows_affected > 0
         except Exception as e:
             raise Exception(f"Failed to create contact: {str(e)}")
@@ -146,16 +183,20 @@ class ContactModel(BaseModel):
     @staticmethod
     def get_all(user_id):
         """Get all contacts for a user"""
-        query = "SELECT * FROM contacts WHERE user_id=?"
+        return list(ContactModel.iter_all(user_id))
+
+    @staticmethod
+    def iter_all(user_id):
+        """Yield a user's contacts one by one, without loading them all at once
+
+        The shard connection is held until the generator is exhausted or closed.
+        """
+        query = CONTACT_SELECT + "WHERE contacts.user_id=?"
+        conn = None
         try:
-            conn = create_connection()
-            cursor = conn.cursor()
-            cursor.execute(query, (user_id,))
-            results = cursor.fetchall()
-            
-            contacts = []
-            for result in results:
-                contacts.append({
+            conn = shard_router.connection_for(user_id)
+            for result in get_backend().stream(conn, query, (user_id,)):
+                yield {
                     "id": result[0],
                     "contact_name": result[1],
                     "contact_phone": result[2],
@@ -163,21 +204,52 @@ class ContactModel(BaseModel):
                     "contact_address": result[4],
                     "contact_gender": result[5],
                     "contact_favorite": result[6],
-                    "user_id": result[7]
-                })
-            return contacts
+                    "user_id": result[7],
+                    "photo_url": blob_url(result[-2]),
+                    "thumbnail_url": blob_url(result[-1])
+                }
         except Exception as e:
             raise Exception(f"Failed to get contacts: {str(e)}")
         finally:
             if conn:
                 conn.close()
 
+    @staticmethod
+    def import_contacts(user_id, contacts):
+        """Bulk insert a list of contact dicts for a user"""
+        columns = [
+            "id", "contact_name", "contact_phone", "contact_email", "contact_address",
+            "contact_gender", "contact_favorite", "user_id", "createdAt", "updatedAt"
+        ]
+        today = date.today().isoformat()
+        rows = [
+            [
+                contact["contact_name"],
+                contact["contact_phone"],
+                contact.get("contact_email", ""),
+                contact.get("contact_address"),
+                contact.get("contact_gender", "other"),
+                contact.get("contact_favorite", 0),
+                user_id,
+                today,
+                today
+            ]
+            for contact in contacts
+        ]
+        try:
+            with shard_router.write_connection(user_id) as conn:
+                ids = get_backend().allocate_ids(conn, "contacts", len(rows))
+                rows = [[contact_id] + row for contact_id, row in zip(ids, rows)]
+                return get_backend().bulk_insert(conn, "contacts", columns, rows)
+        except Exception as e:
+            raise Exception(f"Failed to import contacts: {str(e)}")
+
     @staticmethod
     def get_by_id(contact_id, user_id):
         """Get a single contact by ID"""
-        query = "SELECT * FROM contacts WHERE id=? AND user_id=?"
+        query = CONTACT_SELECT + "WHERE contacts.id=? AND contacts.user_id=?"
         try:
-            result = BaseModel.execute_query(query, (contact_id, user_id), fetch_one=True)
+            result = BaseModel.execute_query(query, (contact_id, user_id), fetch_one=True, user_id=user_id)
             if result:
                 return {
                     "id": result[0],
@@ -187,7 +259,9 @@ class ContactModel(BaseModel):
                     "contact_address": result[4],
                     "contact_gender": result[5],
                     "contact_favorite": result[6],
-                    "user_id": result[7]
+                    "user_id": result[7],
+                    "photo_url": blob_url(result[-2]),
+                    "thumbnail_url": blob_url(result[-1])
                 }
             return None
         except Exception as e:
@@ -199,17 +273,16 @@ class ContactModel(BaseModel):
         if not kwargs:
             raise Exception("No fields to update provided")
             
-        set_clause = ", ".join([f"{key}=?" for key in kwargs.keys()])
-        values = list(kwargs.values())
-        values.extend([contact_id, user_id])
-        
-        query = f"""
-        UPDATE contacts 
-        SET {set_clause}, updatedAt=CURRENT_DATE
-        WHERE id=? AND user_id=?
-        """
         try:
-            rows_affected = BaseModel.execute_query(query, values)
+            query, values = build_update(
+                "contacts",
+                CONTACT_UPDATE_COLUMNS,
+                kwargs,
+                {"id": contact_id, "user_id": user_id}
+            )
+            rows_affected = BaseModel.execute_query(query, values, user_id=user_id)
+            if rows_affected is None:
+                return None
             if rows_affected == 0:
                 raise Exception("Contact not found or not owned by user")
             return True
@@ -221,9 +294,13 @@ class ContactModel(BaseModel):
         """Delete a contact"""
         query = "DELETE FROM contacts WHERE id=? AND user_id=?"
         try:
-            rows_affected = BaseModel.execute_query(query, (contact_id, user_id))
+            rows_affected = BaseModel.execute_query(query, (contact_id, user_id), user_id=user_id)
+            if rows_affected is None:
+                PhotoModel.delete(contact_id, user_id)
+                return None
             if rows_affected == 0:
                 raise Exception("Contact not found or not owned by user")
+            PhotoModel.delete(contact_id, user_id)
             return True
         except Exception as e:
             raise Exception(f"Failed to delete contact: {str(e)}")
@@ -231,9 +308,9 @@ class ContactModel(BaseModel):
     @staticmethod
     def get_added_contact(phone, user_id):
         # get added contact by phone number
-        query = "SELECT * FROM contacts where contact_phone=? AND user_id=?"
+        query = CONTACT_SELECT + "WHERE contacts.contact_phone=? AND contacts.user_id=?"
         try:
-            result = BaseModel.execute_query(query, (phone, user_id), fetch_one=True)
+            result = BaseModel.execute_query(query, (phone, user_id), fetch_one=True, user_id=user_id)
             if result:
                 return {
                     "id": result[0],
@@ -243,13 +320,74 @@ class ContactModel(BaseModel):
                     "contact_address": result[4],
                     "contact_gender": result[5],
                     "contact_favorite": result[6],
-                    "user_id": result[7]
+                    "user_id": result[7],
+                    "photo_url": blob_url(result[-2]),
+                    "thumbnail_url": blob_url(result[-1])
                 }
             return None
         except Exception as e:
             raise Exception(f"Failed to get added contact: {str(e)}")
 
 
+class PhotoModel(BaseModel):
+    """Handles contact photo references; the images live in the blob store"""
+
+    @staticmethod
+    def set(contact_id, user_id, photo_hash):
+        """Point a contact at a new photo, dropping the old thumbnail"""
+        query = """
+        INSERT INTO contact_photos (contact_id, user_id, photo_hash, thumbnail_hash, updatedAt)
+        SELECT ?, ?, ?, NULL, CURRENT_DATE
+        WHERE EXISTS (SELECT 1 FROM contacts WHERE id=? AND user_id=?)
+        ON CONFLICT (contact_id, user_id) DO UPDATE
+        SET photo_hash=excluded.photo_hash, thumbnail_hash=NULL, updatedAt=CURRENT_DATE
+        """
+        try:
+            rows_affected = BaseModel.execute_query(
+                query,
+                (contact_id, user_id, photo_hash, contact_id, user_id),
+                user_id=user_id
+            )
+            if rows_affected is None:
+                return None
+            if rows_affected == 0:
+                raise Exception("Contact not found or not owned by user")
+            return True
+        except Exception as e:
+            raise Exception(f"Failed to set contact photo: {str(e)}")
+
+    @staticmethod
+    def set_thumbnail(contact_id, user_id, photo_hash, thumbnail_hash):
+        """Record a finished thumbnail, unless the photo was replaced meanwhile"""
+        query = """
+        UPDATE contact_photos SET thumbnail_hash=?
+        WHERE contact_id=? AND user_id=? AND photo_hash=?
+        """
+        try:
+            rows_affected = BaseModel.execute_query(
+                query,
+                (thumbnail_hash, contact_id, user_id, photo_hash),
+                user_id=user_id
+            )
+            if rows_affected is None:
+                return None
+            return rows_affected > 0
+        except Exception as e:
+            raise Exception(f"Failed to set contact thumbnail: {str(e)}")
+
+    @staticmethod
+    def delete(contact_id, user_id):
+        """Remove a contact's photo reference"""
+        query = "DELETE FROM contact_photos WHERE contact_id=? AND user_id=?"
+        try:
+            rows_affected = BaseModel.execute_query(query, (contact_id, user_id), user_id=user_id)
+            if rows_affected is None:
+                return None
+            return rows_affected > 0
+        except Exception as e:
+            raise Exception(f"Failed to delete contact photo: {str(e)}")
+
+
 def get_profile(user_id):
     try:
         query = """
@@ -260,11 +398,16 @@ def get_profile(user_id):
                     phone,
                     email,
                     createdAt,
-                    updatedAt,
-                    (SELECT COUNT(*) FROM contacts WHERE user_id=users.id) AS contacts
+                    updatedAt
                 FROM users    
                 WHERE id=?"""
         result = BaseModel.execute_query(query, (user_id,), fetch_one=True)
-        return result if result else None
+        if not result:
+            return None
+
+        # contacts live on the user's shard, not next to the users table
+        count_query = "SELECT COUNT(*) FROM contacts WHERE user_id=?"
+        contacts = BaseModel.execute_query(count_query, (user_id,), fetch_one=True, user_id=user_id)
+        return result + (contacts[0],)
     except Exception as e:
         raise Exception(f"Error retrieving profile: {str(e)}")
\ No newline at end of file
@@ -0,0 +1,269 @@
+import os
+import zlib
+from contextlib import contextmanager
+from database import create_connection, create_tables, get_backend, DB_NAME
+
+# Number of contact shards. Shard 0 is contacts.db itself, which also keeps the
+# users table and the user -> shard directory, so a single-shard setup is the
+# original layout.
+SHARD_COUNT = int(os.environ.get("CONTACTS_SHARD_COUNT", "1"))
+
+# Every shard hands out contact ids from its own range so rows keep their id
+# when a user is moved between shards.
+SHARD_ID_SPAN = 10 ** 12
+
+# Tables holding per-user rows, moved together by move_user()
+USER_TABLES = ("contacts", "contact_photos")
+
+
+def shard_name(shard):
+    """Database name of a shard"""
+    return DB_NAME if shard == 0 else f"{DB_NAME}_shard{shard}"
+
+
+def is_read(query):
+    """Whether a query only reads, so it needs no write transaction"""
+    return query.lstrip().upper().startswith("SELECT")
+
+
+class ShardRouter:
+    """Maps users to the shard database holding their contacts"""
+
+    def __init__(self, shard_count=SHARD_COUNT):
+        if shard_count < 1:
+            raise Exception("Shard count must be at least 1")
+        self.shard_count = shard_count
+        self._prepared = set()
+
+    def shards(self):
+        return range(self.shard_count)
+
+    def connect(self, shard):
+        """Open a connection to a shard, creating its tables on first use"""
+        if not 0 <= shard < self.shard_count:
+            raise Exception(f"Unknown shard: {shard}")
+        conn = create_connection(shard_name(shard))
+        if shard not in self._prepared:
+            self._prepare(conn, shard)
+            self._prepared.add(shard)
+        return conn
+
+    def _prepare(self, conn, shard):
+        backend = get_backend()
+        backend.prepare_database(conn)
+        cursor = conn.cursor()
+        if shard == 0:
+            create_tables()
+            cursor.execute("""CREATE TABLE IF NOT EXISTS user_shards (
+                user_id INTEGER PRIMARY KEY,
+                shard INTEGER NOT NULL
+            )""")
+        else:
+            # users live on shard 0, so there is no foreign key here
+            cursor.execute(f"""CREATE TABLE IF NOT EXISTS contacts (
+                id {backend.id_column},
+                contact_name VARCHAR(100) NOT NULL,
+                contact_phone VARCHAR(15) NOT NULL,
+                contact_email VARCHAR(100) NOT NULL,
+                contact_address VARCHAR(100),
+                contact_gender VARCHAR(7) CHECK(contact_gender IN ('male', 'female', 'other')),
+                contact_favorite INTEGER DEFAULT 0,
+                user_id INTEGER NOT NULL,
+                createdAt DATE,
+                updatedAt DATE
+            )""")
+            cursor.execute("""CREATE UNIQUE INDEX IF NOT EXISTS unique_phone_user_idx
+                ON contacts (contact_phone, user_id)""")
+            backend.start_ids(conn, "contacts", shard * SHARD_ID_SPAN)
+        # photo bytes live in the blob store; this only points at them.
+        # Keyed like contacts are looked up, by id and owner, so a photo row
+        # can never be taken for another user's contact.
+        cursor.execute("""CREATE TABLE IF NOT EXISTS contact_photos (
+            contact_id BIGINT NOT NULL,
+            user_id INTEGER NOT NULL,
+            photo_hash CHAR(64) NOT NULL,
+            thumbnail_hash CHAR(64),
+            updatedAt DATE,
+            PRIMARY KEY (contact_id, user_id)
+        )""")
+        cursor.execute("""CREATE INDEX IF NOT EXISTS contact_photos_user_idx
+            ON contact_photos (user_id)""")
+        conn.commit()
+
+    def _lookup(self, user_id, directory_conn=None):
+        # Users without a directory entry predate sharding and live on shard 0
+        conn = directory_conn or self.connect(0)
+        try:
+            row = conn.execute("SELECT shard FROM user_shards WHERE user_id=?", (user_id,)).fetchone()
+            return row[0] if row else 0
+        finally:
+            if directory_conn is None:
+                conn.close()
+
+    def shard_for(self, user_id):
+        """Get the shard holding a user's contacts"""
+        return self._lookup(user_id)
+
+    def assign(self, user_id):
+        """Place a new user on a shard by hashing their id"""
+        shard = zlib.crc32(str(user_id).encode("utf-8")) % self.shard_count
+        conn = self.connect(0)
+        try:
+            conn.execute(
+                "INSERT INTO user_shards (user_id, shard) VALUES (?, ?) ON CONFLICT (user_id) DO NOTHING",
+                (user_id, shard)
+            )
+            conn.commit()
+        finally:
+            conn.close()
+        return self.shard_for(user_id)
+
+    def connection_for(self, user_id):
+        """Open a connection to the shard holding a user's contacts"""
+        return self.connect(self.shard_for(user_id))
+
+    def execute(self, user_id, query, params=(), fetch_one=False):
+        """Run a query against a user's shard"""
+        if is_read(query):
+            conn = self.connection_for(user_id)
+            try:
+                cursor = conn.execute(query, params)
+                return cursor.fetchone() if fetch_one else cursor.rowcount
+            finally:
+                conn.close()
+
+        with self.write_connection(user_id) as conn:
+            cursor = conn.execute(query, params)
+            return cursor.fetchone() if fetch_one else cursor.rowcount
+
+    @contextmanager
+    def write_connection(self, user_id):
+        """Connection to a user's shard inside a write transaction, committed on exit"""
+        while True:
+            with self.shard_transaction(self.shard_for(user_id), [user_id]) as (conn, resident):
+                if user_id in resident:
+                    yield conn
+                    return
+
+    @contextmanager
+    def shard_transaction(self, shard, user_ids):
+        """Write transaction on one shard for a group of users, committed on exit
+
+        Yields the connection and the set of those users that still live on
+        the shard. The transaction is started before re-checking the directory,
+        so callers can retry users that move_user() just moved elsewhere.
+        """
+        conn = self.connect(shard)
+        try:
+            get_backend().begin_write(conn, *user_ids)
+            directory_conn = conn if shard == 0 else self.connect(0)
+            try:
+                resident = {user_id for user_id in set(user_ids) if self._lookup(user_id, directory_conn) == shard}
+            finally:
+                if directory_conn is not conn:
+                    directory_conn.close()
+            yield conn, resident
+            conn.commit()
+        finally:
+            conn.close()
+
+    def move_user(self, user_id, target):
+        """Move a user's contacts to another shard while the server keeps running"""
+        source = self.shard_for(user_id)
+        if source == target:
+            return 0
+
+        source_conn = self.connect(source)
+        target_conn = self.connect(target)
+        directory_conn = None
+        try:
+            # Holding the source write lock stops new writes for this user
+            # until the directory points at the target shard.
+            backend = get_backend()
+            backend.begin_write(source_conn, user_id, exclusive=True)
+            backend.begin_write(target_conn, user_id)
+            # contacts keep their ids, which belong to another shard's range;
+            # the target's own counter must not jump into that range
+            last_id = backend.last_id(target_conn, "contacts")
+            moved = {}
+            for table in USER_TABLES:
+                cursor = source_conn.execute(f"SELECT * FROM {table} WHERE user_id=?", (user_id,))
+                columns = [column[0] for column in cursor.description]
+                rows = cursor.fetchall()
+                # clear leftovers of an earlier move that failed half way
+                target_conn.execute(f"DELETE FROM {table} WHERE user_id=?", (user_id,))
+                if rows:
+                    backend.bulk_insert(target_conn, table, columns, rows)
+                moved[table] = len(rows)
+            backend.reset_ids(target_conn, "contacts", last_id)
+
+            # Flip the directory in the same transaction as whichever side lives on shard 0
+            if source == 0:
+                directory_conn = source_conn
+            elif target == 0:
+                directory_conn = target_conn
+            else:
+                directory_conn = self.connect(0)
+            directory_conn.execute(
+                """INSERT INTO user_shards (user_id, shard) VALUES (?, ?)
+                ON CONFLICT (user_id) DO UPDATE SET shard=excluded.shard""",
+                (user_id, target)
+            )
+            target_conn.commit()
+            directory_conn.commit()
+
+            for table in USER_TABLES:
+                source_conn.execute(f"DELETE FROM {table} WHERE user_id=?", (user_id,))
+            source_conn.commit()
+            return moved["contacts"]
+        except Exception as e:
+            source_conn.rollback()
+            target_conn.rollback()
+            if directory_conn is not None:
+                directory_conn.rollback()
+            raise Exception(f"Failed to move user {user_id} to shard {target}: {str(e)}")
+        finally:
+            if directory_conn not in (None, source_conn, target_conn):
+                directory_conn.close()
+            source_conn.close()
+            target_conn.close()
+
+    def fan_out(self, query, params=()):
+        """Run a read-only query on every shard and concatenate the rows"""
+        rows = []
+        for shard in self.shards():
+            conn = self.connect(shard)
+            try:
+                rows.extend(conn.execute(query, params).fetchall())
+            finally:
+                conn.close()
+        return rows
+
+
+shard_router = ShardRouter()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Contact shard administration")
+    commands = parser.add_subparsers(dest="command", required=True)
+    where = commands.add_parser("where", help="show the shard holding a user")
+    where.add_argument("user_id", type=int)
+    move = commands.add_parser("move", help="move a user to another shard")
+    move.add_argument("user_id", type=int)
+    move.add_argument("shard", type=int)
+    commands.add_parser("stats", help="count contacts on every shard")
+    args = parser.parse_args()
+
+    if args.command == "where":
+        print(shard_router.shard_for(args.user_id))
+    elif args.command == "move":
+        moved = shard_router.move_user(args.user_id, args.shard)
+        print(f"Moved {moved} contacts of user {args.user_id} to shard {args.shard}")
+    else:
+        for shard in shard_router.shards():
+            conn = shard_router.connect(shard)
+            count = conn.execute("SELECT COUNT(*) FROM contacts").fetchone()[0]
+            conn.close()
+            print(f"shard {shard} ({shard_name(shard)}.db): {count} contacts")
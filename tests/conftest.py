@@ -0,0 +1,84 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from backends import SQLiteBackend
+from database import set_backend
+from sharding import shard_router
+
+
+@pytest.fixture
+def sqlite_backend(tmp_path):
+    """Fresh SQLite databases in a temporary directory"""
+    backend = SQLiteBackend(str(tmp_path))
+    set_backend(backend)
+    shard_router._prepared.clear()
+    shard_router.connect(0).close()
+    yield backend
+    set_backend(None)
+    shard_router._prepared.clear()
+
+
+@pytest.fixture
+def two_shards(monkeypatch):
+    monkeypatch.setattr(shard_router, "shard_count", 2)
+
+
+@pytest.fixture(scope="session")
+def postgres_url(tmp_path_factory):
+    """Url with {name} of a PostgreSQL server to test against
+
+    Uses CONTACTS_TEST_POSTGRES_URL, or starts an embedded server when
+    pgserver is installed; skips the test otherwise.
+    """
+    url = os.environ.get("CONTACTS_TEST_POSTGRES_URL")
+    if url:
+        yield url
+        return
+    pgserver = pytest.importorskip("pgserver")
+    server = pgserver.get_server(str(tmp_path_factory.mktemp("pgdata")), cleanup_mode="stop")
+    yield server.get_uri().replace("/postgres?", "/{name}?")
+    server.cleanup()
+
+
+@pytest.fixture
+def postgres_backend(postgres_url):
+    """Fresh PostgreSQL databases for every shard"""
+    psycopg2 = pytest.importorskip("psycopg2")
+    from backends import PostgresBackend
+    from sharding import shard_name
+
+    def recreate(drop_only=False):
+        conn = psycopg2.connect(postgres_url.replace("{name}", "postgres"))
+        conn.autocommit = True
+        cursor = conn.cursor()
+        for shard in shard_router.shards():
+            cursor.execute(f"DROP DATABASE IF EXISTS {shard_name(shard)}")
+            if not drop_only:
+                cursor.execute(f"CREATE DATABASE {shard_name(shard)}")
+        conn.close()
+
+    recreate()
+    backend = PostgresBackend(postgres_url)
+    set_backend(backend)
+    shard_router._prepared.clear()
+    shard_router.connect(0).close()
+    yield backend
+    set_backend(None)
+    shard_router._prepared.clear()
+    recreate(drop_only=True)
+
+
+@pytest.fixture(params=["sqlite_backend", "postgres_backend"])
+def any_backend(request):
+    """Runs a test once on each backend"""
+    return request.getfixturevalue(request.param)
+
+
+@pytest.fixture
+def client(sqlite_backend):
+    from main import app
+    return app.test_client()
@@ -0,0 +1,188 @@
+import io
+import os
+
+import pytest
+
+import router
+from attachments import blob_store, thumbnailer
+from schema import UserModel, ContactModel
+
+PNG = b"\x89PNG\r\n\x1a\n" + b"\x00" * 32
+
+
+@pytest.fixture
+def blob_dir(tmp_path, monkeypatch):
+    directory = str(tmp_path / "blobs")
+    monkeypatch.setattr(blob_store, "directory", directory)
+    # the test image is not decodable; thumbnails are not under test here
+    monkeypatch.setattr(thumbnailer, "available", False)
+    return directory
+
+
+def stored_blobs(directory):
+    return [name for _, _, names in os.walk(directory) for name in names]
+
+
+def create_user(name):
+    UserModel.create(name, "other", "0000000000", f"{name}@example.com", "x")
+    return UserModel.find_by_email(f"{name}@example.com")["id"]
+
+
+def test_upload_needs_owned_contact_before_storing(client, blob_dir):
+    owner, other = create_user("owner"), create_user("other")
+    ContactModel.create("A", "+100", "", None, "other", 0, owner)
+    contact_id = ContactModel.get_added_contact("+100", owner)["id"]
+
+    for target, user_id in ((contact_id, other), (contact_id + 1000, owner)):
+        response = client.put(f"/contact-photo/{target}?user_id={user_id}", data=PNG)
+        assert response.status_code == 404
+    assert stored_blobs(blob_dir) == []
+
+    response = client.put(f"/contact-photo/{contact_id}?user_id={owner}", data=PNG)
+    assert response.status_code == 201
+    assert len(stored_blobs(blob_dir)) == 1
+    assert ContactModel.get_by_id(contact_id, owner)["photo_url"] == response.get_json()["photo_url"]
+
+
+class CountingStream(io.BytesIO):
+    def __init__(self, data):
+        super().__init__(data)
+        self.bytes_read = 0
+
+    def read(self, size=-1):
+        chunk = super().read(size)
+        self.bytes_read += len(chunk)
+        return chunk
+
+
+@pytest.mark.parametrize("multipart", [False, True])
+def test_chunked_upload_is_cut_off_at_the_size_limit(client, blob_dir, monkeypatch, multipart):
+    monkeypatch.setattr(router, "MAX_PHOTO_BYTES", 1024)
+    owner = create_user("owner")
+    ContactModel.create("A", "+100", "", None, "other", 0, owner)
+    contact_id = ContactModel.get_added_contact("+100", owner)["id"]
+
+    photo = PNG + b"\x00" * (1024 * 1024)
+    if multipart:
+        from werkzeug.test import EnvironBuilder
+        environ = EnvironBuilder(method="PUT", data={"user_id": str(owner), "photo": (io.BytesIO(photo), "a.png")}).get_environ()
+        body, content_type = environ["wsgi.input"].read(), environ["CONTENT_TYPE"]
+    else:
+        body, content_type = photo, "image/png"
+    stream = CountingStream(body)
+
+    # a chunked request has no Content-Length; the server marks its input as terminated
+    response = client.put(
+        f"/contact-photo/{contact_id}?user_id={owner}",
+        input_stream=stream,
+        content_type=content_type,
+        headers={"Transfer-Encoding": "chunked"},
+        environ_overrides={"wsgi.input_terminated": True}
+    )
+    assert response.status_code == 413
+    assert stream.bytes_read < len(body) // 2
+    assert stored_blobs(blob_dir) == []
+
+
+def test_photo_rows_belong_to_one_owner(any_backend):
+    from schema import PhotoModel
+    from sharding import shard_router
+
+    owner, other = create_user("owner"), create_user("other")
+    shard_router.move_user(owner, 0)
+    shard_router.move_user(other, 0)
+    ContactModel.create("A", "+100", "", None, "other", 0, owner)
+    contact_id = ContactModel.get_added_contact("+100", owner)["id"]
+
+    # a row of another user under the same contact id, as a move leaves behind
+    with shard_router.write_connection(other) as conn:
+        conn.execute(
+            "INSERT INTO contact_photos (contact_id, user_id, photo_hash) VALUES (?, ?, ?)",
+            (contact_id, other, "b" * 64)
+        )
+    assert ContactModel.get_by_id(contact_id, owner)["photo_url"] is None
+
+    PhotoModel.set(contact_id, owner, "a" * 64)
+    assert ContactModel.get_by_id(contact_id, owner)["photo_url"] == f"/blobs/{'a' * 64}"
+    conn = shard_router.connection_for(other)
+    try:
+        row = conn.execute("SELECT photo_hash FROM contact_photos WHERE user_id=?", (other,)).fetchone()
+    finally:
+        conn.close()
+    assert row[0] == "b" * 64
+
+
+def upload_photo(client, name, phone, data=PNG):
+    owner = create_user(name)
+    ContactModel.create("A", phone, "", None, "other", 0, owner)
+    contact_id = ContactModel.get_added_contact(phone, owner)["id"]
+    response = client.put(f"/contact-photo/{contact_id}?user_id={owner}", data=data)
+    assert response.status_code == 201
+    return owner, contact_id, response.get_json()["photo_url"]
+
+
+def test_same_photo_is_stored_once(client, blob_dir):
+    first = upload_photo(client, "a", "+100")
+    second = upload_photo(client, "b", "+200")
+    assert first[2] == second[2]
+    assert len(stored_blobs(blob_dir)) == 1
+
+
+def test_blob_answers_range_and_conditional_requests(client, blob_dir):
+    _, _, photo_url = upload_photo(client, "a", "+100")
+
+    response = client.get(photo_url, headers={"Range": "bytes=0-7"})
+    assert response.status_code == 206
+    assert response.headers["Content-Range"] == f"bytes 0-7/{len(PNG)}"
+    assert response.data == PNG[:8]
+
+    etag = client.get(photo_url).headers["ETag"]
+    response = client.get(photo_url, headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.data == b""
+
+
+def test_thumbnail_is_recorded_for_the_photo(client, blob_dir, monkeypatch):
+    Image = pytest.importorskip("PIL.Image")
+    from schema import PhotoModel
+
+    image = io.BytesIO()
+    Image.new("RGB", (640, 480), (200, 40, 40)).save(image, format="PNG")
+    monkeypatch.setattr(thumbnailer, "available", True)
+    recorded = []
+    set_thumbnail = PhotoModel.set_thumbnail
+
+    def spy(*args):
+        recorded.append(args)
+        return set_thumbnail(*args)
+
+    monkeypatch.setattr(PhotoModel, "set_thumbnail", staticmethod(spy))
+    owner, contact_id, photo_url = upload_photo(client, "a", "+100", image.getvalue())
+    thumbnailer.shutdown()
+
+    assert len(recorded) == 1
+    thumbnail_url = ContactModel.get_by_id(contact_id, owner)["thumbnail_url"]
+    assert recorded[0] == (contact_id, owner, photo_url.rsplit("/", 1)[1], thumbnail_url.rsplit("/", 1)[1])
+    with Image.open(io.BytesIO(client.get(thumbnail_url).data)) as thumbnail:
+        assert max(thumbnail.size) == thumbnailer.size
+
+
+def test_move_user_carries_photos(two_shards, any_backend):
+    from schema import PhotoModel
+    from sharding import shard_router
+
+    owner = create_user("owner")
+    shard_router.move_user(owner, 0)
+    ContactModel.create("A", "+100", "", None, "other", 0, owner)
+    contact_id = ContactModel.get_added_contact("+100", owner)["id"]
+    PhotoModel.set(contact_id, owner, "a" * 64)
+    PhotoModel.set_thumbnail(contact_id, owner, "a" * 64, "b" * 64)
+
+    shard_router.move_user(owner, 1)
+    contact = ContactModel.get_by_id(contact_id, owner)
+    assert (contact["photo_url"], contact["thumbnail_url"]) == (f"/blobs/{'a' * 64}", f"/blobs/{'b' * 64}")
+    conn = shard_router.connect(0)
+    try:
+        assert conn.execute("SELECT COUNT(*) FROM contact_photos WHERE user_id=?", (owner,)).fetchone()[0] == 0
+    finally:
+        conn.close()
@@ -0,0 +1,61 @@
+from backends import StatementCache, StatementStats, _copy_field, statement_kind, to_pyformat
+from schema import UserModel, ContactModel
+
+
+def test_copy_field():
+    assert _copy_field(None) == ""
+    assert _copy_field(True) == "1"
+    assert _copy_field(False) == "0"
+    assert _copy_field(3) == "3"
+    assert _copy_field("") == '""'
+    assert _copy_field('say "hi", bye') == '"say ""hi"", bye"'
+
+
+def test_to_pyformat():
+    assert to_pyformat("SELECT * FROM contacts WHERE id=? AND contact_name LIKE '%a'") == \
+        "SELECT * FROM contacts WHERE id=%s AND contact_name LIKE '%%a'"
+
+
+def test_import_contacts_parity(two_shards, any_backend):
+    UserModel.create("Import", "other", "0000000000", "import@example.com", "x")
+    user_id = UserModel.find_by_email("import@example.com")["id"]
+
+    # as the JSON body of /import-contacts decodes
+    imported = ContactModel.import_contacts(user_id, [
+        {"contact_name": "Full", "contact_phone": "+100", "contact_email": "full@example.com",
+         "contact_address": 'Flat 1, "Rose" Court', "contact_gender": "female", "contact_favorite": True},
+        {"contact_name": "Not favorite", "contact_phone": "+101", "contact_favorite": False},
+        {"contact_name": "Defaults", "contact_phone": "+102"},
+    ])
+    assert imported == 3
+
+    contacts = sorted(ContactModel.get_all(user_id), key=lambda contact: contact["contact_phone"])
+    assert [
+        (contact["contact_name"], contact["contact_email"], contact["contact_address"],
+         contact["contact_gender"], contact["contact_favorite"])
+        for contact in contacts
+    ] == [
+        ("Full", "full@example.com", 'Flat 1, "Rose" Court', "female", 1),
+        ("Not favorite", "", None, "other", 0),
+        ("Defaults", "", None, "other", 0),
+    ]
+    assert len({contact["id"] for contact in contacts}) == 3
+
+
+def test_statement_kind():
+    assert statement_kind("UPDATE contacts SET contact_name=? WHERE id=?") == "UPDATE contacts"
+    assert statement_kind("\n        INSERT INTO contacts \n (id) VALUES (?)") == "INSERT contacts"
+    assert statement_kind("DELETE FROM contact_photos WHERE user_id=?") == "DELETE contact_photos"
+    assert statement_kind("SELECT shard FROM user_shards WHERE user_id=?") == "SELECT"
+    assert statement_kind("BEGIN IMMEDIATE") == "BEGIN"
+
+
+def test_statement_stats_by_kind():
+    stats = StatementStats()
+    cache = StatementCache(2, stats)
+    for query in ["BEGIN IMMEDIATE", "UPDATE contacts SET a=?", "BEGIN IMMEDIATE", "UPDATE contacts SET b=?"]:
+        cache.record(query)
+    snapshot = stats.snapshot()
+    assert (snapshot["hits"], snapshot["misses"]) == (1, 3)
+    assert snapshot["by_statement"]["BEGIN"]["hit_rate"] == 0.5
+    assert snapshot["by_statement"]["UPDATE contacts"] == {"hits": 0, "misses": 2, "hit_rate": 0.0}
@@ -0,0 +1,187 @@
+import os
+import sqlite3
+
+import pytest
+
+import maintenance
+
+
+@pytest.fixture
+def backup_dir(tmp_path):
+    return str(tmp_path / "backups")
+
+
+@pytest.fixture
+def admin(monkeypatch):
+    import router
+    monkeypatch.setattr(router, "ADMIN_TOKEN", "secret")
+    return {"X-Admin-Token": "secret"}
+
+
+def test_unknown_database_is_rejected(sqlite_backend, backup_dir):
+    for task in (maintenance.compact, maintenance.enable_wal, lambda name: maintenance.snapshot(name, backup_dir)):
+        with pytest.raises(Exception, match="Unknown database"):
+            task("../escape")
+    assert not os.path.exists(os.path.join(os.path.dirname(sqlite_backend.directory), "escape.db"))
+
+
+def test_admin_compact_rejects_path(client, admin, sqlite_backend):
+    response = client.post("/admin/compact", json={"db": "../escape"}, headers=admin)
+    assert response.status_code == 400
+    assert not os.path.exists(os.path.join(os.path.dirname(sqlite_backend.directory), "escape.db"))
+
+
+def test_restore_rejects_paths(sqlite_backend, backup_dir, tmp_path):
+    maintenance.snapshot("contacts", backup_dir)
+    for name in ("../outside", "../backups/x", "/etc/passwd", ".."):
+        with pytest.raises(Exception, match="Invalid snapshot name"):
+            maintenance.restore(name, backup_dir)
+
+    # a manifest naming a database or archive outside the snapshot directory
+    manifest = maintenance.list_snapshots(backup_dir)[0]
+    stem = manifest["archive"][:-len(".db.gz")]
+    for field, value, error in (("database", "../escape", "Unknown database"),
+                                ("archive", "../contacts.db", "Invalid snapshot name")):
+        tampered = dict(manifest, **{field: value})
+        with open(os.path.join(backup_dir, f"{stem}.json"), "w") as f:
+            maintenance.json.dump(tampered, f)
+        with pytest.raises(Exception, match=error):
+            maintenance.restore(stem, backup_dir)
+
+
+def test_restore_puts_back_the_whole_set(two_shards, sqlite_backend, backup_dir):
+    from schema import UserModel, ContactModel
+    from sharding import shard_router
+
+    UserModel.create("A", "other", "0000000000", "a@example.com", "x")
+    user_id = UserModel.find_by_email("a@example.com")["id"]
+    shard_router.move_user(user_id, 0)
+    ContactModel.create("Kept", "+100", "", None, "other", 0, user_id)
+
+    stamp = maintenance.snapshot_set(backup_dir)[0]["set"]
+    single = maintenance.snapshot("contacts", backup_dir)["archive"]
+    shard_router.move_user(user_id, 1)
+    ContactModel.create("Lost", "+101", "", None, "other", 0, user_id)
+
+    with pytest.raises(Exception, match="Incomplete snapshot set"):
+        maintenance.restore(single, backup_dir)
+    assert [contact["contact_name"] for contact in ContactModel.get_all(user_id)] == ["Kept", "Lost"]
+
+    results = maintenance.restore(f"contacts-{stamp}", backup_dir)
+    assert sorted(result["database"] for result in results) == maintenance.database_names()
+    assert shard_router.shard_for(user_id) == 0
+    assert [contact["contact_name"] for contact in ContactModel.get_all(user_id)] == ["Kept"]
+    assert shard_router.fan_out("SELECT COUNT(*) FROM contacts WHERE user_id=?", (user_id,)) == [(1,), (0,)]
+
+
+def fill(rows, size=2000):
+    from database import create_connection
+
+    conn = create_connection()
+    try:
+        conn.execute("CREATE TABLE IF NOT EXISTS filler (id INTEGER PRIMARY KEY, payload TEXT)")
+        conn.executemany("INSERT INTO filler (payload) VALUES (?)", [("x" * size,) for _ in range(rows)])
+        conn.commit()
+    finally:
+        conn.close()
+
+
+@pytest.fixture
+def writes_between_steps(sqlite_backend, monkeypatch):
+    """Makes another connection write to contacts.db whenever the backup pauses"""
+    writer = sqlite_backend.open_file(sqlite_backend.path("contacts"))
+
+    def sleep(seconds):
+        writer.execute("INSERT INTO filler (payload) VALUES ('written mid-backup')")
+        writer.commit()
+
+    monkeypatch.setattr(maintenance.time, "sleep", sleep)
+    yield
+    writer.close()
+
+
+def test_backup_stats(sqlite_backend, tmp_path):
+    fill(100)
+    destination = str(tmp_path / "copy.db")
+    stats = maintenance.backup("contacts", destination, pages=8, pause=0)
+
+    assert stats["database"] == "contacts"
+    assert stats["journal_mode"] == "wal"
+    assert stats["restarts"] == 0
+    assert stats["single_step_fallback"] is False
+    page_count = sqlite3.connect(destination).execute("PRAGMA page_count").fetchone()[0]
+    assert stats["steps"] == -(-page_count // 8)
+    assert stats["max_stall_ms"] >= stats["mean_stall_ms"] > 0
+    assert stats["bytes"] == os.path.getsize(destination)
+
+
+def test_backup_counts_restarts_and_finishes_in_one_step(writes_between_steps, tmp_path):
+    fill(100)
+    destination = str(tmp_path / "copy.db")
+    stats = maintenance.backup("contacts", destination, pages=8, pause=1, max_restarts=2)
+
+    assert stats["restarts"] == 3
+    assert stats["single_step_fallback"] is True
+    assert stats["journal_mode"] == "wal"
+    copy = sqlite3.connect(destination)
+    try:
+        # every write that landed before the final step is in the copy
+        assert copy.execute("SELECT COUNT(*) FROM filler").fetchone()[0] >= 103
+        assert copy.execute("PRAGMA integrity_check").fetchone()[0] == "ok"
+    finally:
+        copy.close()
+
+
+def test_backup_refuses_single_step_outside_wal(tmp_path, monkeypatch):
+    from backends import SQLiteBackend
+    from database import set_backend
+    from sharding import shard_router
+
+    backend = SQLiteBackend(str(tmp_path), journal_mode="delete")
+    set_backend(backend)
+    shard_router._prepared.clear()
+    try:
+        shard_router.connect(0).close()
+        fill(100)
+        writer = backend.open_file(backend.path("contacts"))
+        monkeypatch.setattr(maintenance.time, "sleep", lambda seconds: (
+            writer.execute("INSERT INTO filler (payload) VALUES ('x')"), writer.commit()))
+        with pytest.raises(Exception, match="delete journal mode"):
+            maintenance.backup("contacts", str(tmp_path / "copy.db"), pages=8, pause=1, max_restarts=2)
+        writer.close()
+    finally:
+        set_backend(None)
+        shard_router._prepared.clear()
+
+
+def test_compact_frees_pages_after_enabling_incremental_vacuum(sqlite_backend):
+    from database import create_connection
+
+    assert maintenance.enable_incremental_vacuum("contacts")
+    fill(300)
+    conn = create_connection()
+    conn.execute("DELETE FROM filler")
+    conn.commit()
+    conn.close()
+
+    result = maintenance.compact("contacts", pages=0)
+    assert result["incremental_vacuum"] is True
+    assert result["free_pages_before"] > 100
+    assert result["free_pages_after"] == 0
+
+
+def test_restore_refuses_damaged_snapshot(sqlite_backend, backup_dir):
+    fill(10)
+    archive = maintenance.snapshot("contacts", backup_dir)["archive"]
+    path = os.path.join(backup_dir, archive)
+    with open(path, "r+b") as f:
+        f.seek(os.path.getsize(path) // 2)
+        f.write(b"\x00\xff\x00\xff")
+    fill(5)
+
+    with pytest.raises(Exception, match="Checksum mismatch"):
+        maintenance.restore(archive, backup_dir)
+    from database import create_connection
+    conn = create_connection()
+    assert conn.execute("SELECT COUNT(*) FROM filler").fetchone()[0] == 15
+    conn.close()
@@ -0,0 +1,68 @@
+import itertools
+
+import pytest
+
+from querybuilder import CONTACT_UPDATE_COLUMNS, build_update, canonical_columns, _update_sql
+from schema import UserModel, ContactModel
+
+WHERE = {"id": 7, "user_id": 3}
+
+
+@pytest.mark.parametrize("key", [
+    "contact_name=1; --",
+    "contact_name = 'x', user_id",
+    "user_id",
+    "id",
+    "updatedAt",
+])
+def test_unknown_keys_are_rejected_before_any_sql(key):
+    _update_sql.cache_clear()
+    with pytest.raises(Exception, match="Unknown fields"):
+        build_update("contacts", CONTACT_UPDATE_COLUMNS, {"contact_name": "A", key: "x"}, WHERE)
+    assert _update_sql.cache_info().currsize == 0
+
+
+def test_no_fields_is_rejected():
+    with pytest.raises(Exception, match="No fields"):
+        build_update("contacts", CONTACT_UPDATE_COLUMNS, {}, WHERE)
+
+
+def test_field_order_does_not_change_the_sql():
+    fields = {"contact_phone": "+1", "contact_name": "A", "contact_favorite": 1}
+    queries = {
+        build_update("contacts", CONTACT_UPDATE_COLUMNS, dict(order), WHERE)[0]
+        for order in itertools.permutations(fields.items())
+    }
+    assert queries == {
+        "UPDATE contacts SET contact_name=?, contact_phone=?, contact_favorite=?, "
+        "updatedAt=CURRENT_DATE WHERE id=? AND user_id=?"
+    }
+
+
+def test_params_are_set_values_then_where_values():
+    _, params = build_update(
+        "contacts", CONTACT_UPDATE_COLUMNS,
+        {"contact_favorite": 0, "contact_email": "a@example.com"}, WHERE
+    )
+    assert params == ["a@example.com", 0, 7, 3]
+
+
+def test_canonical_columns_follow_the_allowlist():
+    assert canonical_columns({"contact_gender": 1, "contact_name": 1}, CONTACT_UPDATE_COLUMNS) == \
+        ("contact_name", "contact_gender")
+
+
+def test_update_of_another_users_contact_is_not_found(sqlite_backend):
+    for name in ("owner", "other"):
+        UserModel.create(name, "other", "0000000000", f"{name}@example.com", "x")
+    owner = UserModel.find_by_email("owner@example.com")["id"]
+    other = UserModel.find_by_email("other@example.com")["id"]
+    ContactModel.create("A", "+100", "", None, "other", 0, owner)
+    contact_id = ContactModel.get_added_contact("+100", owner)["id"]
+
+    with pytest.raises(Exception, match="not found"):
+        ContactModel.update(contact_id, other, contact_name="Taken")
+    assert ContactModel.get_by_id(contact_id, owner)["contact_name"] == "A"
+
+    assert ContactModel.update(contact_id, owner, contact_name="B")
+    assert ContactModel.get_by_id(contact_id, owner)["contact_name"] == "B"
@@ -0,0 +1,77 @@
+import pytest
+
+import router
+from schema import UserModel, ContactModel
+
+
+@pytest.fixture
+def user_id(sqlite_backend):
+    UserModel.create("Router", "other", "0000000000", "router@example.com", "x")
+    return UserModel.find_by_email("router@example.com")["id"]
+
+
+@pytest.mark.parametrize("body", [
+    {"contacts": "abc"},
+    {"contacts": ["abc"]},
+    {"contacts": [{"contact_name": "A", "contact_phone": "+100"}, 1]},
+    {"contacts": {"contact_name": "A", "contact_phone": "+100"}},
+    {"contacts": []},
+])
+def test_import_rejects_malformed_contacts(client, user_id, body):
+    response = client.post("/import-contacts", json=dict(body, user_id=user_id))
+    assert response.status_code == 400
+    assert response.is_json
+
+
+def test_import_rejects_non_object_body(client, user_id):
+    response = client.post("/import-contacts", json=["abc"])
+    assert response.status_code == 400
+    assert response.is_json
+
+
+def test_import_limits_batch_size(client, user_id, monkeypatch):
+    monkeypatch.setattr(router, "MAX_IMPORT_CONTACTS", 2)
+    contacts = [{"contact_name": "A", "contact_phone": f"+10{i}"} for i in range(3)]
+    response = client.post("/import-contacts", json={"user_id": user_id, "contacts": contacts})
+    assert response.status_code == 413
+    assert ContactModel.get_all(user_id) == []
+
+    response = client.post("/import-contacts", json={"user_id": user_id, "contacts": contacts[:2]})
+    assert response.status_code == 201
+    assert response.get_json()["count"] == 2
+
+
+def test_contacts_are_streamed(client, user_id, monkeypatch):
+    ContactModel.import_contacts(user_id, [
+        {"contact_name": f"Contact {i}", "contact_phone": f"+1{i:04d}"} for i in range(1200)
+    ])
+    fetched = []
+    original = ContactModel.iter_all
+
+    def counting_iter_all(user_id):
+        for contact in original(user_id):
+            fetched.append(contact["id"])
+            yield contact
+
+    monkeypatch.setattr(ContactModel, "iter_all", staticmethod(counting_iter_all))
+    response = client.get(f"/contacts/{user_id}", buffered=False)
+    chunks = response.response
+    next(chunks)
+    # only the first rows have been read when the response starts
+    assert len(fetched) < 1200
+
+    b"".join(chunks)
+    response.close()
+    assert len(fetched) == 1200
+
+    response = client.get(f"/contacts/{user_id}")
+    data = response.get_json()
+    assert data["status"] == 200
+    assert data["count"] == 1200
+    assert [contact["contact_phone"] for contact in data["contacts"]][:2] == ["+10000", "+10001"]
+
+
+def test_no_contacts_is_404(client, user_id):
+    response = client.get(f"/contacts/{user_id}")
+    assert response.status_code == 404
+    assert response.get_json()["message"] == "No contacts found"
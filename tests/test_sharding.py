@@ -0,0 +1,77 @@
+from schema import UserModel, ContactModel
+from sharding import shard_router, SHARD_ID_SPAN
+
+
+def create_user(name):
+    UserModel.create(name, "other", "0000000000", f"{name}@example.com", "x")
+    return UserModel.find_by_email(f"{name}@example.com")["id"]
+
+
+def add_contact(user_id, phone):
+    ContactModel.create(f"Contact {phone}", phone, "", None, "other", 0, user_id)
+    return ContactModel.get_added_contact(phone, user_id)["id"]
+
+
+def contacts_of(user_id):
+    return {contact["id"]: contact["contact_phone"] for contact in ContactModel.get_all(user_id)}
+
+
+def test_new_contacts_stay_in_shard_range_after_moves(two_shards, any_backend):
+    a, b, c = create_user("a"), create_user("b"), create_user("c")
+    for user_id, shard in ((a, 1), (b, 1), (c, 0)):
+        shard_router.move_user(user_id, shard)
+
+    expected = {
+        a: {add_contact(a, "+100")},
+        b: {add_contact(b, "+200")},
+        c: {add_contact(c, "+300")},
+    }
+    assert all(SHARD_ID_SPAN <= contact_id < 2 * SHARD_ID_SPAN for contact_id in expected[a] | expected[b])
+
+    shard_router.move_user(a, 0)
+    # shard 0 now holds one of shard 1's ids; its next id must not follow it
+    new_id = add_contact(c, "+301")
+    assert new_id < SHARD_ID_SPAN
+    expected[c].add(new_id)
+
+    shard_router.move_user(b, 0)
+    shard_router.move_user(a, 1)
+    expected[a].add(add_contact(a, "+101"))
+    shard_router.move_user(c, 1)
+    expected[b].add(add_contact(b, "+201"))
+    shard_router.move_user(b, 1)
+    shard_router.move_user(a, 0)
+    expected[c].add(add_contact(c, "+302"))
+
+    all_ids = [contact_id for ids in expected.values() for contact_id in ids]
+    assert len(all_ids) == len(set(all_ids))
+    for user_id, ids in expected.items():
+        assert set(contacts_of(user_id)) == ids
+
+
+def test_import_after_move_uses_own_range(two_shards, any_backend):
+    a, b = create_user("a"), create_user("b")
+    shard_router.move_user(a, 1)
+    shard_router.move_user(b, 0)
+    add_contact(a, "+100")
+    shard_router.move_user(a, 0)
+
+    ContactModel.import_contacts(b, [{"contact_name": "B", "contact_phone": f"+2{i}"} for i in range(3)])
+    assert all(contact_id < SHARD_ID_SPAN for contact_id in contacts_of(b))
+
+    shard_router.move_user(a, 1)
+    shard_router.move_user(b, 1)
+    assert len(contacts_of(a)) == 1
+    assert len(contacts_of(b)) == 3
+
+
+def test_user_is_created_when_shard_assignment_fails(sqlite_backend, two_shards, monkeypatch):
+    def fail(user_id):
+        raise Exception("directory unavailable")
+
+    monkeypatch.setattr(shard_router, "assign", fail)
+    assert UserModel.create("d", "other", "0000000000", "d@example.com", "x")
+    user_id = UserModel.find_by_email("d@example.com")["id"]
+    assert shard_router.shard_for(user_id) == 0
+    add_contact(user_id, "+400")
+    assert list(contacts_of(user_id).values()) == ["+400"]
@@ -0,0 +1,43 @@
+import pytest
+
+from schema import UserModel, ContactModel
+from writer import write_pipeline, DURABILITY_SYNC, DURABILITY_ASYNC
+
+
+@pytest.fixture(params=[DURABILITY_SYNC, DURABILITY_ASYNC])
+def pipeline(request, monkeypatch):
+    monkeypatch.setattr(write_pipeline, "enabled", True)
+    monkeypatch.setattr(write_pipeline, "durability", request.param)
+    yield request.param
+    write_pipeline.stop()
+
+
+def create_user():
+    UserModel.create("Writer", "other", "0000000000", "writer@example.com", "x")
+    return UserModel.find_by_email("writer@example.com")["id"]
+
+
+def test_contact_writes_report_what_is_known(client, pipeline):
+    user_id = create_user()
+    contact = {"contact_name": "A", "contact_phone": "+100", "contact_email": "",
+               "contact_gender": "other", "user_id": user_id}
+
+    added = client.post("/add-contact", json=contact)
+    duplicate = client.post("/add-contact", json=contact)
+    missing_update = client.put("/update-contact/999", json={"user_id": user_id, "contact_name": "B"})
+    missing_delete = client.delete("/delete-contact/999", json={"user_id": user_id})
+    write_pipeline.flush()
+
+    if pipeline == DURABILITY_ASYNC:
+        for response in (added, missing_update, missing_delete):
+            assert response.status_code == 202
+            assert "data" not in response.get_json()
+            assert "success" not in response.get_json()["message"]
+    else:
+        assert added.status_code == 201
+        assert added.get_json()["data"]["contact_phone"] == "+100"
+        assert duplicate.status_code == 409
+        assert missing_update.status_code == 404
+        assert missing_delete.status_code == 404
+    assert duplicate.status_code in (202, 409)
+    assert [contact["contact_phone"] for contact in ContactModel.get_all(user_id)] == ["+100"]
@@ -0,0 +1,158 @@
+import atexit
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+from database import get_backend
+from sharding import shard_router
+
+# Contact writes normally commit one transaction (and one fsync) per request.
+# With the pipeline on, a single writer thread collects them and commits each
+# shard's share of a batch together.
+PIPELINE_ENABLED = os.environ.get("CONTACTS_WRITE_PIPELINE", "0") == "1"
+
+# sync: a request waits until its write is committed (the default)
+# async: a request returns once its write is queued; a crash can lose the
+# writes of the last batch and errors only reach the server log
+DURABILITY_SYNC = "sync"
+DURABILITY_ASYNC = "async"
+DURABILITY = os.environ.get("CONTACTS_WRITE_DURABILITY", DURABILITY_SYNC)
+
+BATCH_SIZE = int(os.environ.get("CONTACTS_WRITE_BATCH_SIZE", "64"))
+BATCH_DELAY = float(os.environ.get("CONTACTS_WRITE_BATCH_DELAY_MS", "2")) / 1000
+
+
+class _Write:
+    def __init__(self, user_id, query, params):
+        self.user_id = user_id
+        self.query = query
+        self.params = params
+        self.detached = False
+        self.future = Future()
+
+
+class WritePipeline:
+    """Queues contact writes and group-commits them from one writer thread"""
+
+    def __init__(self, enabled=PIPELINE_ENABLED, durability=DURABILITY,
+                 batch_size=BATCH_SIZE, batch_delay=BATCH_DELAY):
+        if durability not in (DURABILITY_SYNC, DURABILITY_ASYNC):
+            raise Exception(f"Unknown write durability: {durability}")
+        self.enabled = enabled
+        self.durability = durability
+        self.batch_size = batch_size
+        self.batch_delay = batch_delay
+        self.batches = 0
+        self.writes = 0
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def submit(self, user_id, query, params=(), durability=None):
+        """Queue a write for a user's shard
+
+        Returns the affected row count once committed, or None straight away
+        for async durability, where the write is only queued and its outcome
+        is not known yet.
+        """
+        self._start()
+        write = _Write(user_id, query, params)
+        write.detached = (durability or self.durability) == DURABILITY_ASYNC
+        self._queue.put(write)
+        if write.detached:
+            return None
+        return write.future.result()
+
+    def flush(self):
+        """Wait until everything queued so far is committed"""
+        if self._thread is not None:
+            self._queue.join()
+
+    def stop(self):
+        """Commit what is queued and stop the writer thread"""
+        with self._lock:
+            if self._thread is None:
+                return
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+
+    def _start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="contact-writer", daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            first = self._queue.get()
+            if first is None:
+                self._queue.task_done()
+                return
+            batch = [first]
+            stopping = False
+            deadline = time.monotonic() + self.batch_delay
+            while len(batch) < self.batch_size:
+                try:
+                    write = self._queue.get(timeout=max(deadline - time.monotonic(), 0))
+                except queue.Empty:
+                    break
+                if write is None:
+                    stopping = True
+                    break
+                batch.append(write)
+
+            try:
+                self._commit(batch)
+            except Exception as e:
+                for write in batch:
+                    if not write.future.done():
+                        write.future.set_exception(e)
+            finally:
+                for write in batch:
+                    # nobody waits on async writes, so their errors go to the log
+                    if write.detached and write.future.exception() is not None:
+                        print(f"Queued contact write failed: {write.future.exception()}")
+                    self._queue.task_done()
+            self.batches += 1
+            self.writes += len(batch)
+
+            if stopping:
+                self._queue.task_done()
+                return
+
+    def _commit(self, batch):
+        backend = get_backend()
+        pending = batch
+        while pending:
+            by_shard = {}
+            for write in pending:
+                by_shard.setdefault(shard_router.shard_for(write.user_id), []).append(write)
+
+            pending = []
+            for shard, writes in by_shard.items():
+                committed = []
+                with shard_router.shard_transaction(shard, [write.user_id for write in writes]) as (conn, resident):
+                    for write in writes:
+                        if write.user_id not in resident:
+                            # moved to another shard since we looked; go round again
+                            pending.append(write)
+                            continue
+                        # a savepoint per write keeps one bad write from failing its batch
+                        conn.execute("SAVEPOINT contact_write")
+                        try:
+                            rowcount = conn.execute(write.query, write.params).rowcount
+                            conn.execute("RELEASE SAVEPOINT contact_write")
+                            committed.append((write, rowcount))
+                        except backend.Error as e:
+                            conn.execute("ROLLBACK TO SAVEPOINT contact_write")
+                            conn.execute("RELEASE SAVEPOINT contact_write")
+                            write.future.set_exception(e)
+                for write, rowcount in committed:
+                    write.future.set_result(rowcount)
+
+
+write_pipeline = WritePipeline()
+atexit.register(write_pipeline.stop)